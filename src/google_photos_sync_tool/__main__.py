@@ -2,9 +2,15 @@ import argparse
 import logging
 import sys
 import textwrap
+from datetime import date
 
+from google_photos_sync_tool.batchrun import run_batch
 from google_photos_sync_tool.photossync import PhotosSync
-from google_photos_sync_tool.config import Config, ALBUM_CONFIG_FILE, FILE_PATH_SHORTENING_REGEX
+from google_photos_sync_tool.scanstate import ScanState
+from google_photos_sync_tool.sharding import SHARD_BY, run_workers
+from google_photos_sync_tool.config import Config, ALBUM_CONFIG_FILE, FILE_PATH_SHORTENING_REGEX, LOCAL_SCAN_STATE_FILE, MAX_DESCRIPTION_UPDATES_PER_RUN, TRANSCODE_MAX_RESOLUTION, TRANSCODE_QUALITY, UPLOAD_ORDER, UPLOAD_BANDWIDTH_LIMITS
+from google_photos_sync_tool.transcoder import Transcoder
+from google_photos_sync_tool.uploadscheduler import BandwidthSchedule, UploadScheduler, UPLOAD_ORDERS, album_priorities, bandwidth_limit, parse_size
 
 logger = logging.getLogger()
 
@@ -33,6 +39,20 @@ def main():
     parser.add_argument('--log-level', default='INFO', choices=log_levels)
     parser.add_argument('--log-scope', help="'root' only shows this script's log, 'all' shows logs from libraries, useful for debugging", default='root', choices=log_scope)
     parser.add_argument("--pretend", help="Dry-run mode, do not do anything, just simulate.", action="store_true")
+    parser.add_argument("--transcode", help="Downscale and re-encode photos before uploading them, metadata is kept. Original files are not modified.", action="store_true")
+    parser.add_argument("--transcode-max-resolution", help="Max width/height in pixels of transcoded photos", type=int, default=TRANSCODE_MAX_RESOLUTION)
+    parser.add_argument("--transcode-quality", help="JPEG quality of transcoded photos (1-95)", type=int, default=TRANSCODE_QUALITY)
+    parser.add_argument("--upload-order", help="Order in which photos are uploaded, 'album-priority' uses 'UploadPriority' from album mapping", default=UPLOAD_ORDER, choices=UPLOAD_ORDERS)
+    parser.add_argument("--bandwidth-limit", help="Upload bandwidth limit in bytes per second, e.g: '2M', or for a time of day: '08:00-18:00=500K', can be specified multiple times", action='append', type=bandwidth_limit, default=None)
+    parser.add_argument("--max-upload-bytes", help="Max bytes to upload in this run, e.g: '10G', photos that don't fit are left for next run", type=parse_size)
+    parser.add_argument("--max-upload-time", help="Max minutes spent uploading in this run, photos that don't fit are left for next run", type=float)
+    parser.add_argument("--update-descriptions", help=f"Also update description of photos already on Google Photos when it changed locally, one API call per photo, at most {MAX_DESCRIPTION_UPDATES_PER_RUN} per run", action="store_true")
+    parser.add_argument("--incremental", help=f"add-to-albums only: only list directories that changed since last run and only sync new or changed photos, state is kept in '{LOCAL_SCAN_STATE_FILE}'", action="store_true")
+    parser.add_argument("--shard-store", help="Sharded mode (add-to-albums only): SQLite file, on a filesystem shared by all workers, used to coordinate them")
+    parser.add_argument("--shard-by", help="How --path is split into shards in sharded mode", default='top-dir', choices=SHARD_BY)
+    parser.add_argument("--shards", help="Number of shards when using --shard-by hash, must be the same for all workers", type=int, default=16)
+    parser.add_argument("--shard-run", help="Identifies a run in sharded mode, workers of a same run share shards", default=date.today().isoformat())
+    parser.add_argument("--workers", help="Number of worker processes to start on this host in sharded mode", type=int, default=1)
 
     subparsers = parser.add_subparsers(title="actions available", dest="action")  # would add 'required=True' but breaks for python 3.6
 
@@ -54,6 +74,10 @@ def main():
     parser_sync_to_albums_album_filter_group.add_argument("--album", help="album to proceed, can be specified multiple times, if omitted assume all albums", action='append', choices=albums)
     parser_sync_to_albums_album_filter_group.add_argument("--album-ignore", help="album to ignore, can be specified multiple times, if omitted assume all albums", action='append', choices=albums)
 
+    parser_batch = subparsers.add_parser('batch', help="Run add-to-albums for several paths, each with its own albums mapping, listed in a manifest (see batch.yaml.sample). Jobs share a single Google Photos listing and run concurrently.")
+    parser_batch.add_argument("--manifest", help="YAML file listing jobs, each with a 'Path' and an 'AlbumConfig'", required=True)
+    parser_batch.add_argument("--max-concurrent-jobs", help="Max number of jobs running at once, if omitted all jobs run at once", type=int)
+
     subparsers.add_parser('create-missing-albums', help='Create albums defined in Config that are missing on Google Photos, do not add any photos to it.')
     subparsers.add_parser('validate-albums-mapping', help=f"Validate albums mapping from '{ALBUM_CONFIG_FILE}'.")
 
@@ -82,15 +106,47 @@ def main():
 
         logger.debug(f"After album filtering, albums looks like: {config.albums_mapping}")
 
-    if args.action == 'add-to-albums':
+    transcoder = Transcoder(max_resolution=args.transcode_max_resolution, quality=args.transcode_quality) if args.transcode else None
+    scheduler = None
+    if args.action in ('add-to-albums', 'sync-to-albums', 'batch'):
+        try:
+            scheduler = UploadScheduler(
+                bandwidth_schedule=BandwidthSchedule(args.bandwidth_limit or UPLOAD_BANDWIDTH_LIMITS),
+                order=args.upload_order,
+                album_priorities=album_priorities(config.albums_mapping) if args.action != 'batch' else None,
+                max_bytes=args.max_upload_bytes,
+                max_duration=args.max_upload_time * 60 if args.max_upload_time else None)
+        except ValueError as e:
+            # Invalid UploadPriority in album mapping or invalid UPLOAD_BANDWIDTH_LIMITS in config.
+            logger.critical(f"{e}, exiting ...")
+            sys.exit(1)
+
+    if args.shard_store and args.action in ('remove-from-albums', 'sync-to-albums'):
+        logger.critical(f"'{args.action}' needs to scan all photos at once, it can't be used with --shard-store.")
+        sys.exit(1)
+    if args.shard_store and args.action == 'batch':
+        logger.critical("'batch' runs all its jobs in this process, it can't be used with --shard-store.")
+        sys.exit(1)
+    if args.incremental and (args.shard_store or args.action in ('remove-from-albums', 'sync-to-albums', 'batch')):
+        logger.critical(f"--incremental only lists new or changed photos, it can't be used with '{args.action}' or --shard-store.")
+        sys.exit(1)
+
+    if args.action == 'add-to-albums' and args.shard_store:
         __filter_albums()
-        ps = PhotosSync()
+        run_workers(args.workers, args.path, config, args.shard_store, args.shard_run, args.shard_by, args.shards,
+                    pretend=args.pretend, transcoder=transcoder, scheduler=scheduler, update_descriptions=args.update_descriptions)
+    elif args.action == 'add-to-albums':
+        __filter_albums()
+        ps = PhotosSync(scan_state=ScanState(config.albums_mapping) if args.incremental else None)
         ps.list_local_photos(args.path)
         ps.load_local_photos_exif_data()
         ps.match_local_photos_to_albums(config)
-        ps.upload_photos(pretend=args.pretend)
+        ps.upload_photos(pretend=args.pretend, transcoder=transcoder, scheduler=scheduler)
+        if args.update_descriptions:
+            ps.update_photos_metadata(pretend=args.pretend)
         ps.create_missing_albums(config, pretend=args.pretend)
         ps.add_photos_to_albums(pretend=args.pretend)
+        ps.finish_run(pretend=args.pretend)
     elif args.action == 'remove-from-albums':
         __filter_albums()
         ps = PhotosSync()
@@ -98,23 +154,31 @@ def main():
         ps.load_local_photos_exif_data()
         ps.match_local_photos_to_albums(config)
         ps.remove_photos_from_albums(pretend=args.pretend)
+        ps.finish_run(pretend=args.pretend)
     elif args.action == 'sync-to-albums':
         __filter_albums()
         ps = PhotosSync()
         ps.list_local_photos(args.path)
         ps.load_local_photos_exif_data()
         ps.match_local_photos_to_albums(config)
-        ps.upload_photos(pretend=args.pretend)
+        ps.upload_photos(pretend=args.pretend, transcoder=transcoder, scheduler=scheduler)
+        if args.update_descriptions:
+            ps.update_photos_metadata(pretend=args.pretend)
         ps.create_missing_albums(config, pretend=args.pretend)
         ps.add_photos_to_albums(pretend=args.pretend)
         ps.remove_photos_from_albums(pretend=args.pretend)
+        ps.finish_run(pretend=args.pretend)
+    elif args.action == 'batch':
+        run_batch(args.manifest, pretend=args.pretend, transcoder=transcoder, scheduler=scheduler, workers=args.max_concurrent_jobs,
+                  update_descriptions=args.update_descriptions)
     elif args.action == 'create-missing-albums':
         __filter_albums()
         ps = PhotosSync()
         ps.create_missing_albums(config, pretend=args.pretend)
+        ps.finish_run(pretend=args.pretend)
     elif args.action == 'validate-albums-mapping':
         is_config_okay = True
-        supported_fields = {'FilePath', 'KeywordsIncl', 'KeywordsExcl'}
+        supported_fields = {'FilePath', 'KeywordsIncl', 'KeywordsExcl', 'UploadPriority'}
         for album_name in config.albums_mapping:
             if 'FilePath' not in config.albums_mapping[album_name].keys():
                 logger.critical(f"'{album_name}' is missing required field 'FilePath'.")
@@ -123,6 +187,11 @@ def main():
             if unsupported_fields:
                 logger.critical(f"'{album_name}' has unsupported fields: {', '.join(unsupported_fields)}. Only {', '.join(supported_fields)} are allowed.")
                 is_config_okay = False
+            try:
+                album_priorities({album_name: config.albums_mapping[album_name]})
+            except ValueError as e:
+                logger.critical(f"{e}.")
+                is_config_okay = False
         if is_config_okay:
             logger.info('Album mapping is valid :-)')
         else:
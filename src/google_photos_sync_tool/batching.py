@@ -0,0 +1,111 @@
+"""
+Batching logic shared by all batch API calls (mediaItems.batchCreate, albums.batchAddMediaItems, albums.batchRemoveMediaItems).
+
+Batches start at the max size allowed by the API. When a whole batch is rejected because of its items (HTTP 400), it
+is split in two halves which are sent on their own, until a bad item ends up isolated in a batch of its own while the
+others go through. Batch size for new batches is halved on such failure and grows back after each successful call.
+An item rejected alone fails right away, the API would reject it again. Items reported as failed (per-item status)
+are retried, only them, up to 'max_retries' times.
+
+Other errors aren't about items: on aborted (409), quota (429) or server (5xx) errors, the same batch is retried after a backoff,
+up to 'max_retries' times, on auth (401, 403) or any other error, or once retries are exhausted, remaining items fail.
+Splitting these batches would only multiply calls bound to fail the same way.
+"""
+
+import logging
+import time
+from collections import deque, namedtuple
+
+from googleapiclient import errors
+
+logger = logging.getLogger()
+
+# 'result' is what the API returned for this item (if any), 'error' why it failed (if it did).
+BatchItemResult = namedtuple('BatchItemResult', ['item', 'ok', 'result', 'error'])
+
+
+class BatchRunner:
+    # 'call' takes a list of items, sends them in one API call and returns a list of (ok, result, error), one per item.
+    # It raises errors.HttpError if the whole batch failed.
+    def __init__(self, name, call, max_batch_size, max_retries, pause=0, backoff=5):
+        self.name = name
+        self.call = call
+        self.max_batch_size = max_batch_size
+        self.max_retries = max_retries
+        self.pause = pause  # Seconds to wait between calls
+        self.backoff = backoff  # Seconds to wait before first retry of a whole batch, doubled on each retry
+        self.calls = 0
+        self.duration = 0
+
+    def run(self, items, pretend=False):
+        items = list(items)
+        if pretend:
+            self.calls = -(-len(items) // self.max_batch_size)
+            logger.info(f'Simulating {self.calls} {self.name} calls for {len(items)} items ...')
+            return []
+
+        self.calls = 0
+        results = [None] * len(items)
+        attempts = [0] * len(items)
+        pending = deque(range(len(items)))
+        splits = deque()  # Halves of failed batches, and batches to retry, sent before any new batch.
+        batch_size = self.max_batch_size
+        batch_failures = 0  # Consecutive errors not about items (see module doc)
+        t0 = time.time()
+
+        def retry_or_fail(i, error):
+            attempts[i] += 1
+            if attempts[i] < self.max_retries:
+                pending.append(i)
+            else:
+                logger.warning(f'{self.name} failed for {items[i]} after {attempts[i]} attempts, err:{error}')
+                results[i] = BatchItemResult(items[i], False, None, error)
+
+        while pending or splits:
+            if splits:
+                batch = splits.popleft()
+            else:
+                batch = [pending.popleft() for _ in range(min(batch_size, len(pending)))]
+            if self.calls and self.pause:
+                time.sleep(self.pause)
+            self.calls += 1
+            try:
+                outcomes = self.call([items[i] for i in batch])
+            except errors.HttpError as e:
+                logger.warning(f'HttpError on {self.name} of {len(batch)} items, err:{e.content}')
+                status = e.resp.status
+                if status == 400:
+                    if len(batch) == 1:
+                        logger.warning(f'{self.name} failed for {items[batch[0]]}, err:{e.content}')
+                        results[batch[0]] = BatchItemResult(items[batch[0]], False, None, e)
+                    else:
+                        batch_size = max(1, min(batch_size, len(batch)) // 2)
+                        splits.extendleft([batch[len(batch) // 2:], batch[:len(batch) // 2]])
+                    continue
+
+                batch_failures += 1
+                if (status in (409, 429) or status >= 500) and batch_failures < self.max_retries:
+                    delay = self.backoff * 2 ** (batch_failures - 1)
+                    logger.info(f'Retrying {self.name} of {len(batch)} items in {delay}s ...')
+                    time.sleep(delay)
+                    splits.appendleft(batch)
+                    continue
+
+                logger.error(f'Giving up {self.name}, {len(batch) + len(pending) + sum(map(len, splits))} items left, err:{e.content}')
+                for i in batch + list(pending) + [i for split in splits for i in split]:
+                    results[i] = BatchItemResult(items[i], False, None, e)
+                break
+
+            batch_failures = 0
+            batch_size = min(self.max_batch_size, batch_size * 2)
+            for i, (ok, result, error) in zip(batch, outcomes):
+                if ok:
+                    results[i] = BatchItemResult(items[i], True, result, None)
+                else:
+                    retry_or_fail(i, error)
+            logger.debug(f'{self.name} of {len(batch)} items done, {len(pending)} items left')
+
+        td = self.duration = (time.time() - t0)
+        succeeded = sum(1 for r in results if r.ok)
+        logger.info('{0}: {1} items succeeded, {2} failed, in {3} calls and {4:.2f}s'.format(self.name, succeeded, len(items) - succeeded, self.calls, td))
+        return results
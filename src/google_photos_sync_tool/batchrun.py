@@ -0,0 +1,162 @@
+"""
+Batch mode: run several add-to-albums jobs, each with its own --path and album config, in one process.
+
+All jobs share one GooglePhotosClient (a single auth and API discovery), one listing of albums, and one search of the
+photos already on Google Photos: date ranges of all jobs are merged and each merged range is searched only once.
+Listing local photos, reading exif data and matching, then uploads and adding photos to albums, run concurrently
+for all jobs (threads). Albums are created by one job at a time, so jobs sharing an album don't create it twice.
+Upload budgets, bandwidth limit and transcoding processes are shared by all jobs, 'UploadPriority' is per job.
+
+Batch manifest (--manifest) format is:
+# <JobName>:
+#   Path: <directory-path-to-photos>
+#   AlbumConfig: <album config file, same format as ALBUM_CONFIG_FILE>
+"""
+
+import logging
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import yaml
+
+from google_photos_sync_tool.config import Config
+from google_photos_sync_tool.googlephotosclient import GooglePhotosClient
+from google_photos_sync_tool.photossync import PhotosSync
+from google_photos_sync_tool.uploadscheduler import album_priorities
+
+logger = logging.getLogger()
+
+
+# Drop-in replacement for GooglePhotosClient caching albums and search results, so jobs sharing it list them only once.
+class SharedGooglePhotosClient:
+    def __init__(self, client):
+        self.client = client
+        self.lock = threading.Lock()
+        self.albums = None
+        self.searches = []  # (date_from, date_to, items) of date ranges already searched
+
+    def list_albums(self):
+        with self.lock:
+            if self.albums is None:
+                self.albums = self.client.list_albums()
+            return list(self.albums)
+
+    def create_album(self, albumName, pretend=False):
+        with self.lock:
+            self.client.create_album(albumName, pretend=pretend)
+            self.albums = None  # Listed again by next list_albums()
+
+    # Parts of [date_from, date_to] (days, both included) not covered by a previous search.
+    def __missing_ranges(self, date_from, date_to):
+        missing = []
+        for searched_from, searched_to, _ in sorted(self.searches, key=lambda s: s[0]):
+            if searched_to < date_from or searched_from > date_to:
+                continue
+            if searched_from > date_from:
+                missing.append((date_from, searched_from - timedelta(days=1)))
+            date_from = max(date_from, searched_to + timedelta(days=1))
+        if date_from <= date_to:
+            missing.append((date_from, date_to))
+        return missing
+
+    # Must be called while holding self.lock.
+    def __search(self, date_from, date_to):
+        for missing_from, missing_to in self.__missing_ranges(date_from, date_to):
+            self.searches.append((missing_from, missing_to, list(self.client.search_items_by_date_range(missing_from, missing_to))))
+
+    # Returns items of all searches overlapping this date range, so possibly some items outside of it.
+    def search_items_by_date_range(self, datetime_from=None, datetime_to=None):
+        date_from, date_to = datetime_from.date(), datetime_to.date()
+        with self.lock:
+            self.__search(date_from, date_to)
+            return [i for searched_from, searched_to, items in self.searches
+                    if searched_from <= date_to and searched_to >= date_from for i in items]
+
+    # Search the union of all these date ranges at once, adjacent or overlapping ones are merged into one search.
+    def prefetch_date_ranges(self, date_ranges):
+        merged = []
+        for date_from, date_to in sorted((f.date(), t.date()) for f, t in date_ranges):
+            if merged and date_from <= merged[-1][1] + timedelta(days=1):
+                merged[-1][1] = max(merged[-1][1], date_to)
+            else:
+                merged.append([date_from, date_to])
+        logger.info(f'Searching google photos for {len(date_ranges)} jobs in {len(merged)} date ranges')
+        with self.lock:
+            for date_from, date_to in merged:
+                self.__search(date_from, date_to)
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+
+def load_manifest(manifest_file):
+    try:
+        with open(manifest_file, 'r') as opened_file:
+            jobs = yaml.load(opened_file.read(), Loader=yaml.BaseLoader)
+    except (yaml.YAMLError, FileNotFoundError) as exc:
+        logger.critical(f"Cannot load batch manifest '{manifest_file}': {exc}")
+        sys.exit(1)
+    if not isinstance(jobs, dict) or not jobs:
+        logger.critical(f"Batch manifest '{manifest_file}' defines no job.")
+        sys.exit(1)
+    for job_name, job in jobs.items():
+        missing_fields = {'Path', 'AlbumConfig'} - set(job.keys() if isinstance(job, dict) else [])
+        if missing_fields:
+            logger.critical(f"Job '{job_name}' is missing required fields: {', '.join(missing_fields)}.")
+            sys.exit(1)
+    return jobs
+
+
+def run_batch(manifest_file, pretend=False, transcoder=None, scheduler=None, workers=None, update_descriptions=False):
+    jobs = load_manifest(manifest_file)
+    configs = {job_name: Config(job['AlbumConfig']) for job_name, job in jobs.items()}
+    client = SharedGooglePhotosClient(GooglePhotosClient())
+    syncs = {job_name: PhotosSync(google_photos_client=client) for job_name in jobs}
+    failed_jobs = []
+
+    def run_job_step(job_name, step):
+        try:
+            step(syncs[job_name], job_name)
+            return True
+        except SystemExit as e:
+            # PhotosSync exits when there's nothing to do (no photos found) or on invalid album config, only stop this job.
+            if e.code:
+                failed_jobs.append(job_name)
+        except Exception:
+            logger.exception(f"Job '{job_name}' failed")
+            failed_jobs.append(job_name)
+        return False
+
+    def match(ps, job_name):
+        logger.info(f"Job '{job_name}': listing and matching photos in {jobs[job_name]['Path']}")
+        ps.list_local_photos(jobs[job_name]['Path'])
+        ps.load_local_photos_exif_data()
+        ps.match_local_photos_to_albums(configs[job_name])
+
+    def create_albums(ps, job_name):
+        ps.create_missing_albums(configs[job_name], pretend=pretend)
+
+    def upload(ps, job_name):
+        logger.info(f"Job '{job_name}': uploading photos and adding them to albums")
+        # Jobs share the scheduler but each orders its photos with its own album priorities, album names may clash.
+        ps.upload_photos(pretend=pretend, transcoder=transcoder, scheduler=scheduler, album_priorities=album_priorities(configs[job_name].albums_mapping))
+        if update_descriptions:
+            ps.update_photos_metadata(pretend=pretend)
+        ps.add_photos_to_albums(pretend=pretend)
+
+    with ThreadPoolExecutor(max_workers=workers or len(jobs)) as executor:
+        matched = list(executor.map(lambda job_name: run_job_step(job_name, match), jobs))
+        job_names = [job_name for job_name, ok in zip(jobs, matched) if ok]
+
+        client.prefetch_date_ranges([(min(syncs[job_name].photos_to_upload).creationTime, max(syncs[job_name].photos_to_upload).creationTime)
+                                     for job_name in job_names if syncs[job_name].photos_to_upload])
+        # One job at a time, see create_missing_albums()
+        job_names = [job_name for job_name in job_names if run_job_step(job_name, create_albums)]
+        list(executor.map(lambda job_name: run_job_step(job_name, upload), job_names))
+
+    next(iter(syncs.values())).finish_run(pretend=pretend)  # Client, so plan and stats, is shared by all jobs
+    if failed_jobs:
+        logger.error(f"{len(failed_jobs)} of {len(jobs)} jobs failed: {', '.join(failed_jobs)}")
+        sys.exit(1)
@@ -4,6 +4,7 @@ ALBUM_CONFIG_FILE format is:
 #   FilePath: '.*'
 #   KeywordsIncl: '<reg-exp>'
 #   KeywordsExcl: '<reg-exp>'
+#   UploadPriority: <int>  (optional, used with --upload-order album-priority, higher goes first)
 
 """
 
@@ -19,6 +20,50 @@ FALLBACK_TZ = +2
 # This is used to shorten file path which is used as photos identifier (it's human readable and does not change when exifdata gets modified).
 # Not using full path allows changing photos' basedir and hides full path from Google Photos ("filename" field).
 FILE_PATH_SHORTENING_REGEX = r'.*/Photos/'
+# Local files matching this are considered photos.
+PHOTO_FILE_REGEX = r'.*(jpg|JPG)'
+
+# Description of photos on Google Photos is taken from the first of these tags present in exifdata, multiple values (e.g: keywords) are joined with ', '.
+DESCRIPTION_EXIF_TAGS = ['IPTC:Caption-Abstract', 'IPTC:Keywords']
+# Max number of concurrent API calls when updating description of photos already uploaded.
+METADATA_UPDATE_WORKERS = 4
+# Max number of API calls per second shared by concurrent API calls, keeps us away from Google Photos API quota.
+API_MAX_CALLS_PER_SECOND = 10
+
+# Files bigger than this (bytes) are uploaded in chunks of RESUMABLE_UPLOAD_CHUNK_SIZE with resumable upload protocol,
+# interrupted uploads are resumed, even on next run thanks to sessions saved in UPLOAD_SESSIONS_FILE.
+RESUMABLE_UPLOAD_THRESHOLD = 50 * 2**20
+RESUMABLE_UPLOAD_CHUNK_SIZE = 16 * 2**20
+UPLOAD_SESSIONS_FILE = '.google_photos_sync_tool_upload_sessions.json'
+
+# Used with --incremental, what was seen of local directories on last run, to only list directories that changed since.
+LOCAL_SCAN_STATE_FILE = '.google_photos_sync_tool_scan_state.json'
+
+# Access token is refreshed in background this many seconds before it expires.
+TOKEN_REFRESH_MARGIN = 300
+
+# Measurements from previous runs (API calls duration, upload throughput), used to estimate cost of a run with --pretend.
+RUN_STATS_FILE = '.google_photos_sync_tool_stats.json'
+# Google Photos Library API allows 10000 requests per day per project.
+DAILY_API_QUOTA = 10000
+# Used with --update-descriptions, max descriptions updated per run (one API call each), leaves quota for the rest of the run.
+MAX_DESCRIPTION_UPDATES_PER_RUN = DAILY_API_QUOTA // 2
+
+# Used with --transcode, photos are downscaled so their longest side is at most TRANSCODE_MAX_RESOLUTION pixels and re-encoded as JPEG.
+# 4096px is about Google Photos "storage saver" resolution (16MP), anything above that is thrown away by Google anyway.
+TRANSCODE_MAX_RESOLUTION = 4096
+TRANSCODE_QUALITY = 85
+TRANSCODE_WORKERS = None  # None means one worker per CPU
+# Max number of transcoded files waiting to be uploaded, bounds temporary disk usage.
+TRANSCODE_MAX_PENDING_FILES = 16
+
+# Order in which photos are uploaded, one of: newest-first, oldest-first, smallest-first, album-priority ('UploadPriority' in ALBUM_CONFIG_FILE).
+UPLOAD_ORDER = 'newest-first'
+# Upload bandwidth limits (bytes per second), e.g: ['08:00-18:00=500K', '2M'] limits to 500KB/s during office hours and 2MB/s otherwise.
+UPLOAD_BANDWIDTH_LIMITS = []
+
+# Used with --shard-store, seconds after which a shard (or album lock) held by a worker that stopped renewing it can be taken over.
+SHARD_LEASE_DURATION = 300
 
 logger = logging.getLogger()
 
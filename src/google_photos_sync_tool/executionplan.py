@@ -0,0 +1,120 @@
+"""
+Track what a run does (or would do with --pretend): API calls per method, photos and bytes to upload.
+
+Real runs record how long each kind of API call and uploads took in RUN_STATS_FILE, --pretend runs use these
+measurements to estimate how long the real run would take and how much of the daily API quota it would use.
+"""
+
+import logging
+from collections import Counter
+
+from google_photos_sync_tool.config import RUN_STATS_FILE, DAILY_API_QUOTA
+from google_photos_sync_tool.jsonfile import load_json, save_json, locked
+
+logger = logging.getLogger()
+
+
+# Measurements of this run are kept apart and added to stats file on save(), so that concurrent runs (e.g: sharded
+# workers) saving at the same time all get their measurements in.
+class RunStats:
+    def __init__(self, stats_file=RUN_STATS_FILE):
+        self.stats_file = stats_file
+        self.calls, self.uploads = self.__load()  # API method -> {'count': int, 'seconds': float}, {'bytes', 'seconds'}
+        self.new_calls, self.new_uploads = {}, {'bytes': 0, 'seconds': 0}  # Not saved yet
+
+    def __load(self):
+        stats = load_json(self.stats_file)
+        if stats is None:
+            logger.debug(f"'{self.stats_file}' not found, no measurement from previous runs.")
+        elif 'calls' in stats and 'uploads' in stats:
+            return stats['calls'], stats['uploads']
+        else:
+            logger.warning(f"Ignoring invalid '{self.stats_file}': missing 'calls' or 'uploads'")
+        return {}, {'bytes': 0, 'seconds': 0}
+
+    @staticmethod
+    def __add_calls(calls, method, count, seconds):
+        stats = calls.setdefault(method, {'count': 0, 'seconds': 0})
+        stats['count'] += count
+        stats['seconds'] += seconds
+
+    @staticmethod
+    def __add_upload(uploads, size, seconds):
+        uploads['bytes'] += size
+        uploads['seconds'] += seconds
+
+    def record_calls(self, method, count, seconds):
+        self.__add_calls(self.calls, method, count, seconds)
+        self.__add_calls(self.new_calls, method, count, seconds)
+
+    def record_upload(self, size, seconds):
+        self.__add_upload(self.uploads, size, seconds)
+        self.__add_upload(self.new_uploads, size, seconds)
+
+    def seconds_per_call(self, method):
+        stats = self.calls.get(method)
+        return stats['seconds'] / stats['count'] if stats and stats['count'] else None
+
+    def upload_rate(self):
+        return self.uploads['bytes'] / self.uploads['seconds'] if self.uploads['seconds'] else None
+
+    def save(self):
+        with locked(self.stats_file):
+            calls, uploads = self.__load()
+            for method, stats in self.new_calls.items():
+                self.__add_calls(calls, method, stats['count'], stats['seconds'])
+            self.__add_upload(uploads, self.new_uploads['bytes'], self.new_uploads['seconds'])
+            save_json(self.stats_file, {'calls': calls, 'uploads': uploads}, indent=2)
+        self.calls, self.uploads = calls, uploads
+        self.new_calls, self.new_uploads = {}, {'bytes': 0, 'seconds': 0}
+
+
+class ExecutionPlan:
+    def __init__(self):
+        self.calls = Counter()
+        self.photos_to_upload = 0
+        self.bytes_to_upload = 0
+        self.photos_deferred = 0  # Not fitting in this run's budget (--max-upload-bytes, --max-upload-time)
+        self.bytes_deferred = 0
+
+    def add_calls(self, method, count=1):
+        self.calls[method] += count
+
+    def add_upload(self, size):
+        self.photos_to_upload += 1
+        self.bytes_to_upload += size
+        self.calls['v1/uploads'] += 1  # Each upload is a request that counts towards quota
+
+    def add_deferred(self, size, count=1):
+        self.photos_deferred += count
+        self.bytes_deferred += size
+
+    def report(self, run_stats):
+        logger.info('Execution plan:')
+        logger.info('  {0} photos to upload, {1:.1f}MB'.format(self.photos_to_upload, self.bytes_to_upload / 2**20))
+        if self.photos_deferred:
+            logger.info('  {0} photos, {1:.1f}MB, left for next run, they do not fit in this run budget'.format(self.photos_deferred, self.bytes_deferred / 2**20))
+
+        estimated_seconds, unmeasured = 0, []
+        upload_rate = run_stats.upload_rate()
+        if self.bytes_to_upload and upload_rate:
+            estimated_seconds += self.bytes_to_upload / upload_rate
+        elif self.bytes_to_upload:
+            unmeasured.append('uploads')
+
+        for method, count in sorted(self.calls.items()):
+            logger.info(f'  {count} {method} calls')
+            if method == 'v1/uploads':
+                continue
+            seconds_per_call = run_stats.seconds_per_call(method)
+            if seconds_per_call is not None:
+                estimated_seconds += count * seconds_per_call
+            else:
+                unmeasured.append(method)
+
+        total_calls = sum(self.calls.values())
+        logger.info('  Estimated duration: {0:.1f}min{1}'.format(
+            estimated_seconds / 60, f" (not counting {', '.join(unmeasured)}, never measured by a previous run)" if unmeasured else ''))
+        logger.info('  Estimated API quota usage: {0} requests, {1:.1f}% of daily quota ({2})'.format(total_calls, 100 * total_calls / DAILY_API_QUOTA, DAILY_API_QUOTA))
+        if total_calls > DAILY_API_QUOTA:
+            logger.warning('This run would exceed daily API quota!')
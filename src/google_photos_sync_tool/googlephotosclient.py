@@ -1,7 +1,10 @@
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from httplib2 import Http
 import logging
+import os
 import requests
+import threading
 import time
 
 from apiclient.discovery import build
@@ -10,11 +13,38 @@ from oauth2client import client
 from oauth2client import file
 from oauth2client import tools
 
-from google_photos_sync_tool.config import CONTRIBUTOR_NAME
+from google_photos_sync_tool.batching import BatchRunner
+from google_photos_sync_tool.executionplan import ExecutionPlan, RunStats
+from google_photos_sync_tool.resumableupload import ResumableUploader, UPLOAD_URL
+from google_photos_sync_tool.tokenmanager import TokenManager
+from google_photos_sync_tool.config import CONTRIBUTOR_NAME, METADATA_UPDATE_WORKERS, API_MAX_CALLS_PER_SECOND, RESUMABLE_UPLOAD_THRESHOLD, \
+    MAX_DESCRIPTION_UPDATES_PER_RUN
 
 logger = logging.getLogger()
 MAX_API_RETRIES = 3
 API_CALL_TIMEOUT = 60
+MAX_DESCRIPTION_LENGTH = 1000  # Google Photos API rejects longer descriptions
+BATCH_CREATE_MAX_SIZE = 50  # Max items per call allowed by Google Photos API
+ALBUM_BATCH_MAX_SIZE = 50
+MEDIA_ITEMS_PAGE_SIZE = 100  # Max allowed by Google Photos API
+# Only request fields we use (partial response), apiclient already asks for gzip responses.
+MEDIA_ITEMS_FIELDS = 'nextPageToken,mediaItems(id,filename,description,mediaMetadata/creationTime,contributorInfo/displayName)'
+
+
+class RateLimiter:
+    # Spaces calls made from any thread so that there are at most 'calls_per_second'.
+    def __init__(self, calls_per_second=API_MAX_CALLS_PER_SECOND):
+        self.interval = 1 / calls_per_second
+        self.lock = threading.Lock()
+        self.next_call_ts = 0
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_call_ts - now
+            self.next_call_ts = max(self.next_call_ts, now) + self.interval
+        if delay > 0:
+            time.sleep(delay)
 
 
 class GooglePhotosClient:
@@ -31,153 +61,261 @@ class GooglePhotosClient:
             flags = tools.argparser.parse_args(args=[])  # tools.run_flow() will call it's own argparse so make it ignore this script's cmd line args
             flow = client.flow_from_clientsecrets(api_cred_file, scopes)
             self.appCreds = tools.run_flow(flow, self.appCredStore, flags)
-        http = self.appCreds.authorize(Http())
-        http.timeout = API_CALL_TIMEOUT
-        self.service = build('photoslibrary', 'v1', http=http)
+        self.token_manager = TokenManager(self.appCreds, timeout=API_CALL_TIMEOUT)
+        self.token_manager.start()
+        self.resumable_uploader = ResumableUploader(self.token_manager)
+        self.service = build('photoslibrary', 'v1', http=self.__authorized_http())
+        self.rate_limiter = RateLimiter()
+        self.thread_local = threading.local()
+        self.stats_lock = threading.Lock()  # Uploads and API calls can be made from several threads (e.g: batch jobs)
+        self.description_updates_left = MAX_DESCRIPTION_UPDATES_PER_RUN  # Shared by all calls of this run
+        self.plan = ExecutionPlan()  # What this run did, or would do with --pretend
+        self.run_stats = RunStats()  # How long calls took, measured over runs
+
+    # 'seconds' is None when call was only simulated, so not measured.
+    def __record_calls(self, method, count, seconds=None):
+        with self.stats_lock:
+            self.plan.add_calls(method, count)
+            if seconds is not None:
+                self.run_stats.record_calls(method, count, seconds)
+
+    def __record_upload(self, size, seconds=None):
+        with self.stats_lock:
+            self.plan.add_upload(size)
+            if seconds is not None:
+                self.run_stats.record_upload(size, seconds)
+
+    def __record_deferred(self, size, count):
+        with self.stats_lock:
+            self.plan.add_deferred(size, count)
+
+    # Bytes per second uploads would go at, to simulate time budget with --pretend, None if it can't be estimated.
+    def __simulated_upload_rate(self, scheduler):
+        measured_rate = self.run_stats.upload_rate()
+        limit = scheduler.bandwidth_schedule.rate_at(datetime.now()) if scheduler else None
+        if scheduler and scheduler.max_duration and not measured_rate and not limit:
+            logger.warning('Cannot simulate upload time budget, no upload measured by a previous run and no bandwidth limit')
+        return min(r for r in (measured_rate, limit) if r) if measured_rate or limit else None
+
+    def __record_batch_runner(self, method, runner, pretend):
+        self.__record_calls(method, runner.calls, None if pretend else runner.duration)
+
+    def __authorized_http(self):
+        return self.token_manager.authorize(Http(timeout=API_CALL_TIMEOUT))
+
+    # httplib2.Http isn't thread-safe, each thread (metadata update workers, batch jobs) makes its API calls with its own.
+    def __thread_http(self):
+        if not hasattr(self.thread_local, 'http'):
+            self.thread_local.http = self.__authorized_http()
+        return self.thread_local.http
 
     # This will only upload photos that aren't already uploaded.
-    def upload(self, photos, batch_size=25, pretend=False):
-        UPLOAD_URL = 'https://photoslibrary.googleapis.com/v1/uploads'
-        all_results = []
+    # If a transcoder is passed, photos are uploaded from their transcoded copy which is deleted once uploaded.
+    # If a scheduler is passed, it paces uploads and photos not fitting in its budget are added to scheduler.deferred.
+    # If 'stop' is passed, it's called before each upload and remaining photos aren't uploaded once it returns True.
+    # With --pretend, photos are still transcoded and budgets applied, so that the plan holds what a real run would send.
+    # Returns a BatchItemResult per photo uploaded, 'result' holds the created item.
+    # Big files (e.g: videos) are uploaded in chunks with resumable upload protocol, others in a single request.
+    def upload(self, photos, pretend=False, transcoder=None, scheduler=None, stop=None):
+        photos_to_send = photos
+        if scheduler:
+            scheduler.start()
+        if transcoder:
+            photos_to_send = transcoder.transcode(photos_to_send)
+        upload_rate = self.__simulated_upload_rate(scheduler) if pretend else None
 
         #  Upload photo and get uploadToken to create item later
-        for p in photos:
+        attempted = set()
+        for p in photos_to_send:
+            if (scheduler and scheduler.out_of_time(pretend=pretend)) or (stop and stop()):
+                # Checked when upload would start, transcoder may have prepared photos well ahead.
+                logger.info("%s, remaining photos are not uploaded" % ("Asked to stop uploading" if stop and stop() else "Time budget of this run is used"))
+                if transcoder:
+                    transcoder.release(p)
+                    photos_to_send.close()  # Stops transcoding and removes transcoded photos not uploaded
+                break
+            elif scheduler and not scheduler.fits(os.path.getsize(p.upload_file_path or p.file_path)):
+                logger.debug("Not uploading %s, it does not fit in this run byte budget" % p.short_file_path)
+                if transcoder:
+                    transcoder.release(p)
+                continue
+
+            attempted.add(p)
+            file_path = p.upload_file_path or p.file_path
+            size = os.path.getsize(file_path)
             if pretend:
                 logger.info("Simulating uploading %s ... " % p.short_file_path)
+                self.__record_upload(size)
+                if scheduler and upload_rate:
+                    scheduler.record_simulated(size / upload_rate)
+                if transcoder:
+                    transcoder.release(p)
                 continue
-            else:
-                logger.debug("Uploading %s ... " % p.short_file_path)
-
-            UPLOAD_HEADERS = {
-                'Authorization': "Bearer " + self.service._http.request.credentials.access_token,
-                'Content-Type': 'application/octet-stream',
-                'X-Goog-Upload-File-Name': p.short_file_path,
-                'X-Goog-Upload-Protocol': "raw",
-            }
-            with open(p.file_path, 'rb') as opened_file:
-                f = opened_file.read()
+
+            logger.debug("Uploading %s ... " % p.short_file_path)
             t0 = time.time()
-            r = requests.post(UPLOAD_URL, data=f, headers=UPLOAD_HEADERS)
+            if size > RESUMABLE_UPLOAD_THRESHOLD:
+                p.uploadToken = self.resumable_uploader.upload(p.short_file_path, file_path, scheduler=scheduler)
+            else:
+                p.uploadToken = self.__upload_raw(p.short_file_path, file_path, scheduler=scheduler)
             td = (time.time() - t0)
-            logger.info('Uploaded {0} in {1:.2f}s '.format(p.short_file_path, td))
+            if p.uploadToken:
+                logger.info('Uploaded {0} ({1:.1f}MB) in {2:.2f}s '.format(p.short_file_path, size / 2**20, td))
+            self.__record_upload(size, td if p.uploadToken else None)
+            if scheduler:
+                scheduler.record(size, td)
 
-            p.uploadToken = r.text
+            if transcoder:
+                transcoder.release(p)
 
-        # Create items from uploadToken
-        payload = {"newMediaItems": []}
-        for (i, p) in enumerate(photos):
-            payload["newMediaItems"].append({
-                    "description": "None",
-                    "simpleMediaItem": {
-                        "uploadToken": p.uploadToken
-                    }})
-            if len(payload["newMediaItems"]) >= batch_size or i == (len(photos) - 1):
-                logger.debug('Creating %s items ...' % len(payload["newMediaItems"]))
-                if pretend:
-                    logger.info("{0} items creation simulated".format(len(payload["newMediaItems"])))
-                    payload["newMediaItems"] = []
-                    continue
-                t0 = time.time()
-                request = self.service.mediaItems().batchCreate(body=payload)
-                results = request.execute(num_retries=MAX_API_RETRIES)
-                all_results += results['newMediaItemResults']
-                td = (time.time() - t0)
-                logger.info('Created {0} items in {1:.2f}s'.format(len(results['newMediaItemResults']), td))
-                payload["newMediaItems"] = []
+        not_attempted = [p for p in photos if p not in attempted]
+        if scheduler:
+            scheduler.deferred.update(not_attempted)
+        self.__record_deferred(sum(os.path.getsize(p.file_path) for p in not_attempted), len(not_attempted))
+        photos = [p for p in photos if p in attempted] if pretend else [p for p in photos if p.uploadToken]
 
-        return all_results
+        # Create items from uploadToken
+        def batch_create(batch):
+            payload = {"newMediaItems": [{
+                "description": p.description or '',
+                "simpleMediaItem": {
+                    "uploadToken": p.uploadToken
+                }} for p in batch]}
+            results = self.service.mediaItems().batchCreate(body=payload).execute(http=self.__thread_http(), num_retries=MAX_API_RETRIES)
+            results_per_token = {r['uploadToken']: r for r in results['newMediaItemResults']}
+            outcomes = []
+            for p in batch:
+                r = results_per_token.get(p.uploadToken, {})
+                # A status code (google.rpc.Code) other than 0 means this item failed, even though the call succeeded.
+                ok = 'mediaItem' in r and not r.get('status', {}).get('code')
+                outcomes.append((ok, r, None if ok else r.get('status', 'missing from newMediaItemResults')))
+            return outcomes
+
+        runner = BatchRunner('batchCreate', batch_create, BATCH_CREATE_MAX_SIZE, MAX_API_RETRIES)
+        results = runner.run(photos, pretend=pretend)
+        self.__record_batch_runner('mediaItems.batchCreate', runner, pretend)
+        return results
+
+    # Returns upload token, None if upload failed.
+    def __upload_raw(self, name, file_path, scheduler=None):
+        token = self.token_manager.get_token()
+        UPLOAD_HEADERS = {
+            'Authorization': "Bearer " + token,
+            'Content-Type': 'application/octet-stream',
+            'X-Goog-Upload-File-Name': name,
+            'X-Goog-Upload-Protocol': "raw",
+        }
+        with open(file_path, 'rb') as opened_file:
+            f = opened_file.read()
+        try:
+            r = requests.post(UPLOAD_URL, data=scheduler.throttle(f) if scheduler else f, headers=UPLOAD_HEADERS)
+            if r.status_code == 401:
+                UPLOAD_HEADERS['Authorization'] = "Bearer " + self.token_manager.refresh_after_401(token)
+                r = requests.post(UPLOAD_URL, data=scheduler.throttle(f) if scheduler else f, headers=UPLOAD_HEADERS)
+            r.raise_for_status()
+        except requests.RequestException as e:
+            logger.warning(f'Failed to upload {name}, err:{e}')
+            return None
+        return r.text
+
+    # 'items' is a list of (google_id, description), returns (updated_count, failed_count).
+    # At most MAX_DESCRIPTION_UPDATES_PER_RUN items are updated per run, others are left for next run.
+    def update_items_description(self, items, workers=METADATA_UPDATE_WORKERS, pretend=False):
+        with self.stats_lock:
+            left_for_next_run = items[self.description_updates_left:]
+            items = items[:self.description_updates_left]
+            self.description_updates_left -= len(items)
+        if left_for_next_run:
+            logger.warning(f'{len(left_for_next_run)} descriptions left for next run, only {MAX_DESCRIPTION_UPDATES_PER_RUN} are updated per run (MAX_DESCRIPTION_UPDATES_PER_RUN)')
+        if not items:
+            return 0, 0
+        if pretend:
+            logger.info("Simulating updating description of %s items ..." % len(items))
+            self.__record_calls('mediaItems.patch', len(items))
+            return 0, 0
+
+        def update(item):
+            google_id, description = item
+            self.rate_limiter.wait()
+            try:
+                self.service.mediaItems().patch(id=google_id, updateMask='description', body={'description': description}) \
+                    .execute(http=self.__thread_http(), num_retries=MAX_API_RETRIES)
+                return True
+            except errors.HttpError as e:
+                # Google Photos only allows updating items uploaded by this app.
+                logger.warning(f'Failed to update description of {google_id}, err:{e.content}')
+                return False
+
+        t0 = time.time()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(update, items))
+        td = (time.time() - t0)
+        self.__record_calls('mediaItems.patch', len(items), td)
+        logger.info('Updated description of {0} items in {1:.2f}s, {2} failed'.format(results.count(True), td, results.count(False)))
+        return results.count(True), results.count(False)
 
     def create_album(self, albumName, pretend=False):
         payload = {"album": {"title": albumName}}
         logger.info('Creating album: %s' % albumName)
+        t0 = time.time()
         if not pretend:
-            self.service.albums().create(body=payload).execute(num_retries=MAX_API_RETRIES)
+            self.service.albums().create(body=payload).execute(http=self.__thread_http(), num_retries=MAX_API_RETRIES)
+        self.__record_calls('albums.create', 1, None if pretend else time.time() - t0)
         return
 
-    def add_items_to_album(self, photos, album_id, batch_size=40, pretend=False):
-        payload = {"mediaItemIds": []}
-        for (i, photo) in enumerate(photos):
-            payload["mediaItemIds"].append(photo.googleId)
-
-            if len(payload["mediaItemIds"]) >= batch_size or i == (len(photos) - 1):
-                if not pretend:
-                    if payload["mediaItemIds"].count(None) > 0:
-                        logger.warning('%s items to add to %s have no google_id !' % (payload["mediaItemIds"].count(None), album_id))
-                    else:
-                        logger.info('All items to add to album have a google_id :-)')
-
-                logger.debug('Adding %s items to album %s ...' % (len(payload["mediaItemIds"]), album_id))
-
-                if pretend:
-                    logger.info("Simulating adding %s items to album %s ..." % (len(payload["mediaItemIds"]), album_id))
-                    payload["mediaItemIds"] = []
-                    continue
-
-                t0 = time.time()
-                # Implementing retry because apiclient doesn't retry on HttpError 409 "The operation was aborted." although retry usually succeed.
-                retries = 0
-                while retries <= MAX_API_RETRIES:
-                    try:
-                        self.service.albums().batchAddMediaItems(albumId=album_id, body=payload).execute(num_retries=MAX_API_RETRIES)
-                        break
-                    except errors.HttpError as e:
-                        logger.warn(f'HttpError while querying {e.uri}, err:{e.content}, retries left:{(MAX_API_RETRIES - retries)}')
-                        retries += 1
-
-                td = (time.time() - t0)
-                time.sleep(1)
-                logger.info('Added {0} items to album in {1:.2f}s ({2}/{3})'.format(len(payload["mediaItemIds"]), td, i+1, len(photos)))
-                payload = {"mediaItemIds": []}
-        return
-
-    def remove_items_from_album(self, photos, album_id, batch_size=40, pretend=False):
-        payload = {"mediaItemIds": []}
-        for (i, photo) in enumerate(photos):
-            payload["mediaItemIds"].append(photo.googleId)
-
-            if len(payload["mediaItemIds"]) >= batch_size or i == (len(photos) - 1):
-                if not pretend:
-                    if payload["mediaItemIds"].count(None) > 0:
-                        logger.warning('%s items to remove from %s have no google_id !' % (payload["mediaItemIds"].count(None), album_id))
-                    else:
-                        logger.info('All items to remove from album have a google_id :-)')
-
-                logger.debug('Removing %s items from album %s ...' % (len(payload["mediaItemIds"]), album_id))
-
-                if pretend:
-                    logger.info("Simulating removing %s items from album %s ..." % (len(payload["mediaItemIds"]), album_id))
-                    payload["mediaItemIds"] = []
-                    continue
-
-                t0 = time.time()
-                self.service.albums().batchRemoveMediaItems(albumId=album_id, body=payload).execute(num_retries=MAX_API_RETRIES)
-                td = (time.time() - t0)
-                time.sleep(1)
-                logger.info('Removed {0} items from album in {1:.2f}s ({2}/{3})'.format(len(payload["mediaItemIds"]), td, i+1, len(photos)))
-                payload = {"mediaItemIds": []}
-        return
+    def __album_batch_runner(self, name, api_method, album_id):
+        def call(batch):
+            api_method(albumId=album_id, body={"mediaItemIds": [photo.googleId for photo in batch]}).execute(http=self.__thread_http(), num_retries=MAX_API_RETRIES)
+            return [(True, None, None)] * len(batch)
+        # apiclient doesn't retry on HttpError 409 "The operation was aborted." although retry usually succeed, BatchRunner does.
+        return BatchRunner(f'{name} {album_id}', call, ALBUM_BATCH_MAX_SIZE, MAX_API_RETRIES, pause=1)
 
     @staticmethod
-    def __filter_items_on_contributor(medias, contributor_name=CONTRIBUTOR_NAME):
-        medias = [i for i in medias if 'contributorInfo' not in i or i['contributorInfo']['displayName'] == contributor_name]
-        return medias
+    def __with_google_id(photos, action, album_id):
+        photos_without_google_id = [photo for photo in photos if not photo.googleId]
+        if photos_without_google_id:
+            logger.warning('%s items to %s %s have no google_id, skipping them !' % (len(photos_without_google_id), action, album_id))
+        return [photo for photo in photos if photo.googleId]
 
-    def __search_items(self, field):
-        medias = []
+    def add_items_to_album(self, photos, album_id, pretend=False):
+        if not pretend:
+            photos = self.__with_google_id(photos, 'add to', album_id)
+        logger.debug('Adding %s items to album %s ...' % (len(photos), album_id))
+        runner = self.__album_batch_runner('batchAddMediaItems', self.service.albums().batchAddMediaItems, album_id)
+        results = runner.run(photos, pretend=pretend)
+        self.__record_batch_runner('albums.batchAddMediaItems', runner, pretend)
+        return results
+
+    def remove_items_from_album(self, photos, album_id, pretend=False):
+        if not pretend:
+            photos = self.__with_google_id(photos, 'remove from', album_id)
+        logger.debug('Removing %s items from album %s ...' % (len(photos), album_id))
+        runner = self.__album_batch_runner('batchRemoveMediaItems', self.service.albums().batchRemoveMediaItems, album_id)
+        results = runner.run(photos, pretend=pretend)
+        self.__record_batch_runner('albums.batchRemoveMediaItems', runner, pretend)
+        return results
+
+    # Yield media items page by page as they come, skipping the ones from other contributors (in shared albums).
+    # 'execute_page' takes a page token and returns (API method name, response of that page).
+    def __iter_media_items(self, execute_page, action, contributor_name=CONTRIBUTOR_NAME):
         next_page_token = ''
-        logger.info('Searching google photos for: %s' % field)
+        count, filtered_out = 0, 0
         ts_log_progress = datetime.now()
         while True:
-            search = {'pageSize': 100,
-                      'pageToken': next_page_token}
-            search.update(field)
-            media_list = self.service.mediaItems().search(body=search).execute(num_retries=MAX_API_RETRIES)
+            t0 = time.time()
+            method, media_list = execute_page(next_page_token)
+            self.__record_calls(method, 1, time.time() - t0)
 
             if 'mediaItems' not in media_list:
                 break
 
-            medias += media_list['mediaItems']
-            logger.debug('Got %i more items while searching, total: %i' % (len(media_list['mediaItems']), len(medias)))
+            for i in media_list['mediaItems']:
+                if 'contributorInfo' in i and i['contributorInfo']['displayName'] != contributor_name:
+                    filtered_out += 1
+                    continue
+                count += 1
+                yield i
+            logger.debug('Got %i more items while %s, total: %i' % (len(media_list['mediaItems']), action, count + filtered_out))
 
             if 'nextPageToken' not in media_list:
                 break
@@ -186,14 +324,21 @@ class GooglePhotosClient:
 
             # Print progress every 60s
             if (datetime.now() - ts_log_progress).total_seconds() > 60:
-                logger.info('Found %i items so far' % len(medias))
+                logger.info('Found %i items so far' % count)
                 ts_log_progress = datetime.now()
 
-        medias_count_before_filtering = len(medias)
-        medias = self.__filter_items_on_contributor(medias)
-        logger.info(f'Found {len(medias)} items while searching google photos, {(medias_count_before_filtering - len(medias))} items filtered out on contributor.')
+        logger.info(f'Found {count} items while {action} google photos, {filtered_out} items filtered out on contributor.')
 
-        return medias
+    def __search_items(self, field):
+        logger.info('Searching google photos for: %s' % field)
+
+        def execute_page(page_token):
+            search = {'pageSize': MEDIA_ITEMS_PAGE_SIZE,
+                      'pageToken': page_token}
+            search.update(field)
+            return 'mediaItems.search', self.service.mediaItems().search(body=search, fields=MEDIA_ITEMS_FIELDS).execute(http=self.__thread_http(), num_retries=MAX_API_RETRIES)
+
+        return self.__iter_media_items(execute_page, 'searching')
 
     # Google Photos API doesn't support conjunction of album and time range filters
     def search_items_by_album(self, album_id):
@@ -217,34 +362,20 @@ class GooglePhotosClient:
 
     def list_items(self):
         logger.info('Listing all google photos...')
-        medias = []
-        next_page_token = ''
-        while True:
-            media_list = self.service.mediaItems().list(pageSize=50, pageToken=next_page_token).execute(num_retries=MAX_API_RETRIES)
-
-            if 'mediaItems' not in media_list:
-                break
 
-            medias += media_list['mediaItems']
-            logger.debug('Got %i more items while listing, total: %i' % (len(media_list['mediaItems']), len(medias)))
+        def execute_page(page_token):
+            return 'mediaItems.list', self.service.mediaItems().list(pageSize=MEDIA_ITEMS_PAGE_SIZE, pageToken=page_token, fields=MEDIA_ITEMS_FIELDS).execute(http=self.__thread_http(), num_retries=MAX_API_RETRIES)
 
-            if 'nextPageToken' not in media_list:
-                break
-
-            next_page_token = media_list['nextPageToken']
-
-        medias_count_before_filtering = len(medias)
-        medias = self.__filter_items_on_contributor(medias)
-        logger.info(f'Found {len(medias)} items while listing google photos, {(medias_count_before_filtering - len(medias))} items filtered out on contributor.')
-
-        return medias
+        return self.__iter_media_items(execute_page, 'listing')
 
     def list_albums(self):
         albums = []
         next_page_token = ''
         while True:
+            t0 = time.time()
             results = self.service.albums().list(
-                pageSize=50, pageToken=next_page_token, fields="nextPageToken,albums(id,title)").execute(num_retries=MAX_API_RETRIES)
+                pageSize=50, pageToken=next_page_token, fields="nextPageToken,albums(id,title)").execute(http=self.__thread_http(), num_retries=MAX_API_RETRIES)
+            self.__record_calls('albums.list', 1, time.time() - t0)
             if 'albums' not in results:
                 break
             albums += results['albums']
@@ -0,0 +1,51 @@
+"""
+JSON files keeping state between runs (run stats, upload sessions, scan state).
+
+Files are written to a unique temporary file then renamed over the previous one, so a crash never leaves a truncated
+file and concurrent writers never share a temporary file. Read-modify-write must be done while holding locked() so that
+concurrent processes (e.g: sharded workers) don't lose each other's changes.
+"""
+
+import fcntl
+import json
+import logging
+import os
+import tempfile
+from contextlib import contextmanager
+
+logger = logging.getLogger()
+
+
+# Returns None if file doesn't exist or is invalid.
+def load_json(path):
+    try:
+        with open(path, 'r') as opened_file:
+            return json.load(opened_file)
+    except FileNotFoundError:
+        return None
+    except ValueError as exc:
+        logger.warning(f"Ignoring invalid '{path}': {exc}")
+        return None
+
+
+def save_json(path, data, indent=None):
+    fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix=os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as opened_file:
+            json.dump(data, opened_file, indent=indent)
+        os.replace(tmp_file, path)
+    except BaseException:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        raise
+
+
+# Exclusive lock on '<path>.lock', held across processes of this host (and hosts sharing the filesystem if flock works on it).
+@contextmanager
+def locked(path):
+    with open(path + '.lock', 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
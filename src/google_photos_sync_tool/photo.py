@@ -20,7 +20,9 @@ class Photo:
         else:
             self.creationTime = creation_time
         self.keywords = kwargs.pop('keywords', None)
+        self.description = kwargs.pop('description', None)
         self.uploadToken = None
+        self.upload_file_path = None  # Transcoded copy to upload instead of file_path, if any
 
     # Not defining __str__ so __repr__ is used
     def __repr__(self):
@@ -11,7 +11,6 @@ TODO: Add option to force listing all photos instead of relying on time range (t
 TODO: Fix hack about wrong timezone, -1d or at make it an option
 TODO: Finish sync feature, now only upload photos and add-to/create albums but doesn't remove from album
 TODO: Some hard-coded values to clean-up
-TODO: Rewrite upload, add_items_to_album, remove_items_from_album from GooglePhotosClient to share batching logic
 TODO: Implement retries on API call failure
 TODO: Improve timezone detection, e.g: DJI store GPS location but not GPS time, to convert into UTC need to resolve TZ from location, maybe with https://pypi.org/project/timezonefinder/
 """
@@ -21,41 +20,61 @@ import logging
 import re
 import sys
 import time
+from contextlib import nullcontext
 from datetime import datetime, timezone, timedelta
 from pprint import pformat
 
 import exiftool
 
-from google_photos_sync_tool.config import FILE_PATH_SHORTENING_REGEX, FALLBACK_TZ
+from google_photos_sync_tool.config import FILE_PATH_SHORTENING_REGEX, FALLBACK_TZ, DESCRIPTION_EXIF_TAGS, PHOTO_FILE_REGEX
 from google_photos_sync_tool.photo import Photo
-from google_photos_sync_tool.googlephotosclient import GooglePhotosClient
+from google_photos_sync_tool.googlephotosclient import GooglePhotosClient, MAX_DESCRIPTION_LENGTH
 
 logger = logging.getLogger()
 
 
 class PhotosSync:
-    def __init__(self):
+    # shard_store is only set when running sharded (see sharding.py), it's used to lock albums between workers.
+    # scan_state is only set with --incremental (see scanstate.py), only new or changed photos are then listed.
+    # google_photos_client is passed when several PhotosSync share one (see batchrun.py).
+    def __init__(self, shard_store=None, scan_state=None, google_photos_client=None):
+        self.shard_store = shard_store
+        self.scan_state = scan_state
         self.albums = []
         self.photos_already_uploaded = set()
-        self.google_photos_client = GooglePhotosClient()
+        self.google_photos_client = google_photos_client or GooglePhotosClient()
         self.google_photos_albums = {}
         self.local_photos = []
         self.local_photos_exif_data = []
         self.photos_to_upload_per_albums = {}
         self.photos_to_upload = set()
+        self.photos_not_added_to_albums = set()  # Failed to be added to at least one of their albums
         self.oldest_photo = None
         self.newest_photo = None
 
-    def list_local_photos(self, path):
-        logger.debug('Listing local photos in %s ... ' % path)
+    @staticmethod
+    def find_local_photos(path, recursive=True):
         local_photos = []
-        photo_iter = glob.iglob(path + '/**/*.*', recursive=True)
-        ext_re = re.compile('.*(jpg|JPG)')  # Make this configurable
+        photo_iter = glob.iglob(path + '/**/*.*', recursive=True) if recursive else glob.iglob(path + '/*.*')
+        ext_re = re.compile(PHOTO_FILE_REGEX)
 
         for f in photo_iter:
             if ext_re.match(f):
                 local_photos.append(f)
-        logger.info('%s photos found in %s ... ' % (len(local_photos), path))
+        return local_photos
+
+    def list_local_photos(self, path):
+        logger.debug('Listing local photos in %s ... ' % path)
+        if self.scan_state:
+            all_local_photos, local_photos = self.scan_state.scan(path)
+            logger.info('%s photos found in %s, %s new or changed since last run ... ' % (len(all_local_photos), path, len(local_photos)))
+            if not local_photos:
+                self.scan_state.save()  # Nothing to sync, safe to save even with --pretend
+                logger.info('No new or changed photos, exiting ...')
+                sys.exit(0)
+        else:
+            local_photos = self.find_local_photos(path)
+            logger.info('%s photos found in %s ... ' % (len(local_photos), path))
 
         if not local_photos:
             logger.critical('No photos found, exiting ...')
@@ -73,7 +92,7 @@ class PhotosSync:
                 "IPTC:Keywords",
                 "EXIF:DateTimeOriginal",
                 "EXIF:SubSecDateTimeOriginal",
-                "EXIF:OffsetTimeOriginal"],
+                "EXIF:OffsetTimeOriginal"] + [t for t in DESCRIPTION_EXIF_TAGS if t != "IPTC:Keywords"],
                 self.local_photos)
             logger.debug('%i of %i retrieved successfully' % (len(self.local_photos_exif_data), len(self.local_photos)))
         td = (time.time() - t0)
@@ -136,6 +155,14 @@ class PhotosSync:
 
         return photo_taken_datetime, tz
 
+    @staticmethod
+    def __get_photo_description(exif_data):
+        for tag in DESCRIPTION_EXIF_TAGS:
+            if exif_data.get(tag):
+                description = ', '.join(str(v) for v in exif_data[tag]) if isinstance(exif_data[tag], list) else str(exif_data[tag])
+                return description[:MAX_DESCRIPTION_LENGTH]
+        return ''
+
     def match_local_photos_to_albums(self, config):
         logger.debug("albumsMapping: %s" % pformat(config.albums_mapping))
         photos_to_upload_per_albums = {}
@@ -178,7 +205,8 @@ class PhotosSync:
                 photos_to_upload_per_albums[album_name].add(
                     Photo(file_path=exif_data["SourceFile"],
                           creationTime=photo_taken_datetime,
-                          keywords=exif_data["IPTC:Keywords"]))
+                          keywords=exif_data["IPTC:Keywords"],
+                          description=self.__get_photo_description(exif_data)))
 
         logger.debug("photosToUploadPerAlbums: %s" % pformat(photos_to_upload_per_albums))
         for album in photos_to_upload_per_albums.keys():
@@ -228,47 +256,82 @@ class PhotosSync:
                 except StopIteration:
                     logger.debug('Cannot find google_id for %s it is either not uploaded yet or we are running with --pretend' % photo)
 
-    def upload_photos(self, pretend=False):
+    # 'stop' is passed to GooglePhotosClient.upload(), 'album_priorities' to UploadScheduler.sort().
+    def upload_photos(self, pretend=False, transcoder=None, scheduler=None, stop=None, album_priorities=None):
         #self.__list_google_photos()  # This list all google photos  # Used this before, but it's too long to list all google photos
         self.__search_google_photos_for_photos_already_uploaded()  # This list all google photos for time range
         self.__copy_google_id_to_photos_to_upload_per_albums(self.photos_already_uploaded)
 
         # Only upload photos that are not already on GooglePhotos (using short_file_path as comparator)
         photos_to_upload_not_already_uploaded = self.photos_to_upload - self.photos_already_uploaded
-        photos_already_uploaded_to_update = self.photos_already_uploaded & self.photos_to_upload
 
         if not photos_to_upload_not_already_uploaded:
             logging.info('No photos to upload, either no photos match albums mapping or all the ones that do are already uploaded.')
             return 0
 
         logging.info("%s photos to upload." % len(photos_to_upload_not_already_uploaded))
-        logging.info("%s photos to update metadata" % len(photos_already_uploaded_to_update))
 
-        results = self.google_photos_client.upload(photos_to_upload_not_already_uploaded, pretend=pretend)
+        if scheduler:
+            photos_to_upload_not_already_uploaded = scheduler.sort(photos_to_upload_not_already_uploaded, self.photos_to_upload_per_albums, album_priorities)
+
+        results = self.google_photos_client.upload(photos_to_upload_not_already_uploaded, pretend=pretend, transcoder=transcoder, scheduler=scheduler, stop=stop)
         logger.debug('results: %s' % results)
 
+        if scheduler:
+            scheduler.report()
+            # Deferred photos are not on Google Photos yet, so they can't be added to albums during this run.
+            for album_name in self.photos_to_upload_per_albums:
+                self.photos_to_upload_per_albums[album_name] -= scheduler.deferred
+
         # Copy google_id from photo_just_uploaded in self.photos_to_upload_per_albums so that we can add them to albums.
-        # Would be nicer to re-use __copy_google_id_to_photos_to_upload_per_albums but needs to convert results from batchCreateItems API call into set() of Photo(s).
+        google_ids_just_uploaded = {r.item.short_file_path: r.result['mediaItem']['id'] for r in results if r.ok}
         for album_name in self.photos_to_upload_per_albums:
             for photo in self.photos_to_upload_per_albums[album_name]:
                 if not photo.googleId:
                     logger.debug('photo: %s' % photo.short_file_path)
-                    try:
-                        photo.googleId = next(photo_just_uploaded['mediaItem']["id"] for photo_just_uploaded in results if photo_just_uploaded['mediaItem']['filename'] == photo.short_file_path)
-                    except StopIteration:
-                        if not pretend:
-                            logger.warning('Cannot find google_id for %s, looks like we failed to upload it.' % photo)
+                    photo.googleId = google_ids_just_uploaded.get(photo.short_file_path)
+                    if not photo.googleId and not pretend:
+                        logger.warning('Cannot find google_id for %s, looks like we failed to upload it.' % photo)
+
+    def __lock(self, name):
+        return self.shard_store.lock(name) if self.shard_store else nullcontext()
+
+    # Must be called after upload_photos(), it relies on photos already uploaded it found on Google Photos.
+    # Returns (updated, skipped, failed), skipped ones are already up-to-date.
+    def update_photos_metadata(self, pretend=False):
+        photos_already_uploaded = {p.short_file_path: p for p in self.photos_already_uploaded}
+        items_to_update = []
+        skipped = 0
+        for photo in self.photos_to_upload:
+            photo_already_uploaded = photos_already_uploaded.get(photo.short_file_path)
+            if not photo_already_uploaded:
+                continue  # Just uploaded with up-to-date description or failed to upload
+            if (photo_already_uploaded.googleDescription or '') == photo.description:
+                skipped += 1
+                continue
+            logger.debug(f"Description of {photo.short_file_path} changed from '{photo_already_uploaded.googleDescription}' to '{photo.description}'")
+            items_to_update.append((photo_already_uploaded.googleId, photo.description))
+
+        logger.info(f'{len(items_to_update)} photos to update metadata, {skipped} photos already up-to-date.')
+        if not items_to_update:
+            return 0, skipped, 0
+        updated, failed = self.google_photos_client.update_items_description(items_to_update, pretend=pretend)
+        if failed:
+            logger.warning(f'Failed to update metadata of {failed} photos, {updated} updated, {skipped} already up-to-date.')
+        return updated, skipped, failed
 
     def create_missing_albums(self, config, pretend=False):
-        self.__list_google_albums()
-        # Create albums if don't already exist.
-        albums_to_create = [a for a in config.albums_mapping.keys() if a not in [d['title'] for d in self.google_photos_albums]]
+        # Google Photos allows several albums with same title, so workers must not list and create albums concurrently.
+        with self.__lock('albums'):
+            self.__list_google_albums()
+            # Create albums if don't already exist.
+            albums_to_create = [a for a in config.albums_mapping.keys() if a not in [d['title'] for d in self.google_photos_albums]]
 
-        for album_to_create in albums_to_create:
-            self.google_photos_client.create_album(album_to_create, pretend=pretend)
+            for album_to_create in albums_to_create:
+                self.google_photos_client.create_album(album_to_create, pretend=pretend)
 
-        if albums_to_create:
-            self.__list_google_albums()
+            if albums_to_create:
+                self.__list_google_albums()
 
     def __get_album_id(self, album_name, pretend):
         # Get album_id from album_name, this can fail if --pretend and album isn't created yet
@@ -288,7 +351,15 @@ class PhotosSync:
             logger.info('%s photos to add to %s album' % (len(self.photos_to_upload_per_albums[album_name]), album_name))
 
             album_id = self.__get_album_id(album_name, pretend)
-            self.google_photos_client.add_items_to_album(self.photos_to_upload_per_albums[album_name], album_id, pretend=pretend)
+            if album_id is None and not pretend:
+                self.photos_not_added_to_albums |= self.photos_to_upload_per_albums[album_name]
+                continue
+            with self.__lock('album:%s' % album_name):
+                results = self.google_photos_client.add_items_to_album(self.photos_to_upload_per_albums[album_name], album_id, pretend=pretend)
+            failed = {r.item for r in results if not r.ok}
+            if failed:
+                logger.warning(f'{len(failed)} photos could not be added to {album_name} album')
+                self.photos_not_added_to_albums |= failed
 
     def remove_photos_from_albums(self, pretend=False):
         if not self.google_photos_albums:
@@ -337,6 +408,17 @@ class PhotosSync:
             logger.info(f'Photos to remove from {album_name}: {photos_to_remove_from_album}')
             self.google_photos_client.remove_items_from_album(photos_to_remove_from_album, album_id, pretend=pretend)
 
+    # With --pretend, report what a real run would have done and cost, otherwise save measurements for next estimates.
+    def finish_run(self, pretend=False):
+        if pretend:
+            self.google_photos_client.plan.report(self.google_photos_client.run_stats)
+        else:
+            self.google_photos_client.run_stats.save()
+            if self.scan_state:
+                # Photos that failed to upload or to be added to an album, or were deferred, are left for next run, even if they didn't change.
+                self.scan_state.forget(photo.file_path for photo in self.photos_to_upload if not photo.googleId or photo in self.photos_not_added_to_albums)
+                self.scan_state.save()
+
     def sync(self, photos, pretend=False):
         # Only upload photos that are not already on GooglePhotos (using short_file_path as comparator)
         #photosToUpload = photos - self.photosAlreadyUploaded
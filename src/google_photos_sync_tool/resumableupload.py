@@ -0,0 +1,128 @@
+"""
+Google Photos resumable upload protocol, used for files bigger than RESUMABLE_UPLOAD_THRESHOLD (e.g: videos).
+
+A session is started, then the file is sent in chunks, read from disk one at a time. When a chunk fails, the server
+is asked how many bytes it committed and upload resumes from there. Session URLs are saved in UPLOAD_SESSIONS_FILE
+so that an upload interrupted by a crash or a Ctrl-C resumes on next run, as long as the file didn't change.
+See https://developers.google.com/photos/library/guides/resumable-uploads
+"""
+
+import logging
+import mimetypes
+import os
+
+import requests
+
+from google_photos_sync_tool.config import UPLOAD_SESSIONS_FILE, RESUMABLE_UPLOAD_CHUNK_SIZE
+from google_photos_sync_tool.jsonfile import load_json, save_json, locked
+
+logger = logging.getLogger()
+UPLOAD_URL = 'https://photoslibrary.googleapis.com/v1/uploads'
+MAX_CHUNK_RETRIES = 5
+
+
+class ResumableUploader:
+    def __init__(self, token_manager, sessions_file=UPLOAD_SESSIONS_FILE, chunk_size=RESUMABLE_UPLOAD_CHUNK_SIZE):
+        self.token_manager = token_manager
+        self.sessions_file = sessions_file
+        self.chunk_size = chunk_size
+
+    def __load_sessions(self):
+        return load_json(self.sessions_file) or {}
+
+    # Sessions file is shared by concurrent uploads (batch jobs, sharded workers), lock it while updating it.
+    def __save_session(self, name, session):
+        with locked(self.sessions_file):
+            sessions = self.__load_sessions()
+            if session:
+                sessions[name] = session
+            else:
+                sessions.pop(name, None)
+            save_json(self.sessions_file, sessions, indent=2)
+
+    # POST with current token, replayed once with a new token on 401.
+    def __post(self, url, headers, data=None):
+        token = self.token_manager.get_token()
+        r = requests.post(url, data=data() if callable(data) else data, headers=dict(headers, Authorization="Bearer " + token))
+        if r.status_code == 401:
+            token = self.token_manager.refresh_after_401(token)
+            r = requests.post(url, data=data() if callable(data) else data, headers=dict(headers, Authorization="Bearer " + token))
+        return r
+
+    def __start_session(self, name, file_path, size):
+        r = self.__post(UPLOAD_URL, {
+            'Content-Length': '0',
+            'X-Goog-Upload-Command': 'start',
+            'X-Goog-Upload-Content-Type': mimetypes.guess_type(file_path)[0] or 'application/octet-stream',
+            'X-Goog-Upload-File-Name': name,
+            'X-Goog-Upload-Protocol': 'resumable',
+            'X-Goog-Upload-Raw-Size': str(size),
+        })
+        r.raise_for_status()
+        granularity = int(r.headers.get('X-Goog-Upload-Chunk-Granularity', 1))
+        return {
+            'url': r.headers['X-Goog-Upload-URL'],
+            'size': size,
+            'mtime': os.path.getmtime(file_path),
+            # Every chunk but the last must be a multiple of granularity
+            'chunk_size': max(granularity, self.chunk_size - self.chunk_size % granularity),
+        }
+
+    # Returns bytes committed by server, None if session can't be resumed (expired or already finalized).
+    def __query_offset(self, session):
+        try:
+            r = self.__post(session['url'], {'Content-Length': '0', 'X-Goog-Upload-Command': 'query'})
+        except requests.RequestException as e:
+            logger.warning(f'Failed to query upload session: {e}')
+            return None
+        if r.status_code != 200 or r.headers.get('X-Goog-Upload-Status') != 'active':
+            return None
+        return int(r.headers.get('X-Goog-Upload-Size-Received', 0))
+
+    # Returns upload token, None if upload failed.
+    def upload(self, name, file_path, scheduler=None):
+        size = os.path.getsize(file_path)
+        session = self.__load_sessions().get(name)
+        offset = None
+        if session and session['size'] == size and session['mtime'] == os.path.getmtime(file_path):
+            offset = self.__query_offset(session)
+            if offset is not None:
+                logger.info('Resuming upload of {0} from {1:.1f}MB'.format(name, offset / 2**20))
+        if offset is None:
+            try:
+                session = self.__start_session(name, file_path, size)
+            except requests.RequestException as e:
+                logger.warning(f'Failed to start upload session for {name}, err:{e}')
+                return None
+            self.__save_session(name, session)
+            offset = 0
+
+        retries = 0
+        with open(file_path, 'rb') as opened_file:
+            while True:
+                opened_file.seek(offset)
+                chunk = opened_file.read(session['chunk_size'])
+                last = offset + len(chunk) >= size
+                try:
+                    r = self.__post(session['url'], {
+                        'Content-Length': str(len(chunk)),
+                        'X-Goog-Upload-Command': 'upload, finalize' if last else 'upload',
+                        'X-Goog-Upload-Offset': str(offset),
+                    }, data=lambda: scheduler.throttle(chunk) if scheduler else chunk)
+                    r.raise_for_status()
+                except requests.RequestException as e:
+                    retries += 1
+                    committed_offset = self.__query_offset(session)
+                    if retries > MAX_CHUNK_RETRIES or committed_offset is None:
+                        logger.warning(f'Failed to upload {name}, err:{e}')
+                        return None
+                    logger.warning('Upload of {0} interrupted at {1:.1f}MB, resuming ... ({2})'.format(name, committed_offset / 2**20, e))
+                    offset = committed_offset
+                    continue
+
+                if last:
+                    self.__save_session(name, None)
+                    return r.text
+                offset += len(chunk)
+                retries = 0  # MAX_CHUNK_RETRIES is per chunk, a long upload may get interrupted many times
+                logger.debug('Uploaded {0:.1f}/{1:.1f}MB of {2}'.format(offset / 2**20, size / 2**20, name))
@@ -0,0 +1,101 @@
+"""
+Incremental listing of local photos (--incremental), only new or changed photos are handed to exif and matching stages.
+
+For each directory, LOCAL_SCAN_STATE_FILE keeps its mtime, its sub-directories and name/size/mtime of its photos.
+A directory whose mtime didn't change is not listed and its photos are not stat'ed, what was saved for it is used instead.
+
+Photos matching no album are seen too, so when albums mapping (after --album/--album-ignore filtering) changed since
+last run, all photos are considered changed, otherwise photos that now match an album would never be synced.
+
+A directory's mtime only changes when entries are added, removed or renamed in it, not when something changes deeper
+in its sub-directories, so each directory still needs to be stat'ed, but that's one stat per directory instead of one
+per file. Tools rewriting photos' metadata (e.g: exiftool) write a new file and rename it over the original one, which
+changes directory's mtime, but a photo modified in place is only seen when something else changes in its directory.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+
+from google_photos_sync_tool.config import LOCAL_SCAN_STATE_FILE, PHOTO_FILE_REGEX, FILE_PATH_SHORTENING_REGEX
+from google_photos_sync_tool.jsonfile import load_json, save_json, locked
+
+logger = logging.getLogger()
+PHOTO_FILE_RE = re.compile(PHOTO_FILE_REGEX)
+
+
+class ScanState:
+    # 'albums_mapping' is the one photos are matched against, see Config.
+    def __init__(self, albums_mapping, state_file=LOCAL_SCAN_STATE_FILE):
+        self.state_file = state_file
+        self.albums_mapping_digest = hashlib.sha1(json.dumps([albums_mapping, FILE_PATH_SHORTENING_REGEX], sort_keys=True).encode()).hexdigest()
+        # abspath of scanned path -> {'albums_mapping': digest, 'dirs': {relative dir: {'mtime', 'dirs', 'files': {name: [size, mtime]}}}}
+        self.roots = load_json(state_file) or {}
+        self.root = None
+        self.dirs = {}
+        self.listed_dirs = 0
+        if not self.roots:
+            logger.debug(f"'{state_file}' not found, all photos are new.")
+
+    # Returns (all photos, new or changed photos) under path.
+    def scan(self, path):
+        self.root = os.path.abspath(path)
+        saved = self.roots.get(self.root) or {}
+        previous_dirs = saved.get('dirs', {})
+        if previous_dirs and saved.get('albums_mapping') != self.albums_mapping_digest:
+            logger.info('Albums mapping changed since last run, all photos are considered changed.')
+            previous_dirs = {}
+        self.dirs = {}
+        self.listed_dirs = 0
+        all_photos, changed_photos = [], []
+        self.__scan_dir(path, '', os.stat(path).st_mtime_ns, previous_dirs, all_photos, changed_photos)
+        logger.info(f'{len(self.dirs)} directories scanned, {self.listed_dirs} changed since last run.')
+        return all_photos, changed_photos
+
+    def __scan_dir(self, path, rel_dir, mtime, previous_dirs, all_photos, changed_photos):
+        dir_path = os.path.join(path, rel_dir) if rel_dir else path
+        previous = previous_dirs.get(rel_dir)
+        if previous and previous['mtime'] == mtime:
+            files, sub_dirs = previous['files'], previous['dirs']
+        else:
+            self.listed_dirs += 1
+            files, sub_dirs = {}, []
+            with os.scandir(dir_path) as entries:
+                for entry in entries:
+                    if entry.name.startswith('.'):
+                        continue  # Like glob does
+                    if entry.is_dir():
+                        sub_dirs.append(entry.name)
+                    elif PHOTO_FILE_RE.match(entry.name):
+                        stat = entry.stat()
+                        files[entry.name] = [stat.st_size, stat.st_mtime_ns]
+            previous_files = previous['files'] if previous else {}
+            changed_photos += [os.path.join(dir_path, name) for name, meta in files.items() if previous_files.get(name) != meta]
+        all_photos += [os.path.join(dir_path, name) for name in files]
+
+        for name in sorted(sub_dirs):
+            sub_dir = os.path.join(rel_dir, name)
+            try:
+                sub_dir_mtime = os.stat(os.path.join(path, sub_dir)).st_mtime_ns
+            except FileNotFoundError:
+                continue  # Removed since parent was listed
+            self.__scan_dir(path, sub_dir, sub_dir_mtime, previous_dirs, all_photos, changed_photos)
+
+        self.dirs[rel_dir] = {'mtime': mtime, 'dirs': sub_dirs, 'files': files}
+
+    # Photos that weren't synced (e.g: failed or deferred uploads) are seen as new on next run.
+    def forget(self, photo_paths):
+        for photo_path in photo_paths:
+            rel_dir, name = os.path.split(os.path.relpath(os.path.abspath(photo_path), self.root))
+            entry = self.dirs.get(rel_dir)
+            if entry and entry['files'].pop(name, None):
+                entry['mtime'] = None  # So that directory gets listed again
+
+    # Only this scan's root is replaced, other runs may have saved other roots since this one started.
+    def save(self):
+        with locked(self.state_file):
+            self.roots = load_json(self.state_file) or {}
+            self.roots[self.root] = {'albums_mapping': self.albums_mapping_digest, 'dirs': self.dirs}
+            save_json(self.state_file, self.roots)
@@ -0,0 +1,240 @@
+"""
+Sharded add-to-albums: split --path into shards and let several workers (processes, possibly on different hosts) process them.
+
+Shards are either top-level directories of --path ('.' holds files directly in --path) or buckets of a stable hash of file paths.
+Workers coordinate through a SQLite file (--shard-store) on a filesystem they all share:
+- A worker claims a shard by taking a lease on it, the lease is renewed in background and expires if the worker dies
+  so that another worker can take the shard over. A worker that lost its lease stops uploading (checked before each
+  upload) and moves on to the next shard, leaving that one to the worker that took it over.
+- Album creation and adding items to an album are done while holding a lock (also a lease) so workers don't create
+  duplicate albums or send concurrent batches to the same album.
+Shards are tracked per run (--shard-run, defaults to today's date) so a nightly run does not see yesterday's shards as done.
+
+Note SQLite relies on file locks, make sure they work on the shared filesystem (e.g: NFS needs lockd).
+"""
+
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from multiprocessing import Process
+
+from google_photos_sync_tool.config import SHARD_LEASE_DURATION
+from google_photos_sync_tool.photossync import PhotosSync
+
+logger = logging.getLogger()
+
+SHARD_BY = ('top-dir', 'hash')
+
+
+class LeaseLostError(Exception):
+    pass
+
+
+class ShardStore:
+    def __init__(self, db_file, run_id, lease_duration=SHARD_LEASE_DURATION):
+        self.db_file = db_file
+        self.run_id = run_id
+        self.lease_duration = lease_duration
+        self.owner = f'{socket.gethostname()}:{os.getpid()}'
+        self.lost_leases = set()  # Names of leases the background renewal lost, see __keep()
+        self.db = self.__connect()
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS shards (run TEXT, name TEXT, done INTEGER DEFAULT 0, PRIMARY KEY (run, name));
+            CREATE TABLE IF NOT EXISTS leases (name TEXT PRIMARY KEY, owner TEXT, expires REAL);
+        ''')
+
+    def __connect(self):
+        return sqlite3.connect(self.db_file, timeout=60, isolation_level=None)
+
+    @staticmethod
+    @contextmanager
+    def __transaction(db):
+        db.execute('BEGIN IMMEDIATE')  # Take write lock right away so that read-then-write is atomic between workers.
+        try:
+            yield
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+
+    def __shard_lease(self, shard):
+        return f'shard:{self.run_id}:{shard}'
+
+    def __acquire(self, db, lease_name):
+        row = db.execute('SELECT owner, expires FROM leases WHERE name = ?', (lease_name,)).fetchone()
+        if row and row[0] != self.owner and row[1] > time.time():
+            return False
+        db.execute('INSERT OR REPLACE INTO leases (name, owner, expires) VALUES (?, ?, ?)', (lease_name, self.owner, time.time() + self.lease_duration))
+        return True
+
+    # Returns False if lease was taken over by another worker.
+    def renew(self, lease_name, db=None):
+        db = db or self.db
+        with self.__transaction(db):
+            row = db.execute('SELECT owner FROM leases WHERE name = ?', (lease_name,)).fetchone()
+            if not row or row[0] != self.owner:
+                return False
+            db.execute('UPDATE leases SET expires = ? WHERE name = ?', (time.time() + self.lease_duration, lease_name))
+            return True
+
+    def release(self, lease_name):
+        self.db.execute('DELETE FROM leases WHERE name = ? AND owner = ?', (lease_name, self.owner))
+
+    def add_shards(self, shards):
+        with self.__transaction(self.db):
+            self.db.executemany('INSERT OR IGNORE INTO shards (run, name) VALUES (?, ?)', [(self.run_id, s) for s in shards])
+
+    def claim_shard(self):
+        with self.__transaction(self.db):
+            for (shard,) in self.db.execute('SELECT name FROM shards WHERE run = ? AND done = 0 ORDER BY name', (self.run_id,)).fetchall():
+                if self.__acquire(self.db, self.__shard_lease(shard)):
+                    return shard
+        return None
+
+    def complete_shard(self, shard):
+        with self.__transaction(self.db):
+            self.db.execute('UPDATE shards SET done = 1 WHERE run = ? AND name = ?', (self.run_id, shard))
+        self.release(self.__shard_lease(shard))
+
+    # Returns True once background renewal of this shard's lease failed, cheap enough to be checked before each upload.
+    def shard_lost(self, shard):
+        return self.__shard_lease(shard) in self.lost_leases
+
+    def check_shard(self, shard):
+        if self.shard_lost(shard) or not self.renew(self.__shard_lease(shard)):
+            raise LeaseLostError(f"Lost lease on shard '{shard}', another worker may have taken it over")
+
+    @contextmanager
+    def keep_shard(self, shard):
+        with self.__keep(self.__shard_lease(shard)):
+            yield
+
+    @contextmanager
+    def lock(self, name):
+        t0 = time.time()
+        while True:
+            with self.__transaction(self.db):
+                if self.__acquire(self.db, name):
+                    break
+            time.sleep(1)
+        logger.debug('Acquired lock %s in %.2fs' % (name, time.time() - t0))
+        try:
+            with self.__keep(name):
+                yield
+        finally:
+            self.release(name)
+
+    # Renew lease in background, sqlite3 connections can't be shared between threads so the thread opens its own.
+    # If lease is taken over, or can't be renewed before it expires, it's added to lost_leases.
+    @contextmanager
+    def __keep(self, lease_name):
+        stop = threading.Event()
+        self.lost_leases.discard(lease_name)
+
+        def keep_renewing():
+            db = self.__connect()
+            renewed = time.time()
+            while not stop.wait(self.lease_duration / 3):
+                try:
+                    if not self.renew(lease_name, db=db):
+                        logger.error(f'Lost lease {lease_name}, it was taken over by another worker')
+                        self.lost_leases.add(lease_name)
+                        break
+                    renewed = time.time()
+                except sqlite3.OperationalError as e:
+                    # e.g: 'database is locked' when the shared filesystem is busy, retried until the lease expires.
+                    logger.warning(f'Failed to renew lease {lease_name}, err:{e}')
+                    if time.time() - renewed >= self.lease_duration:
+                        logger.error(f'Lost lease {lease_name}, it expired before it could be renewed')
+                        self.lost_leases.add(lease_name)
+                        break
+            db.close()
+
+        keeper = threading.Thread(target=keep_renewing, daemon=True)
+        keeper.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            keeper.join()
+
+
+def list_shards(path, shard_by, shards):
+    if shard_by == 'hash':
+        return ['hash-%i' % i for i in range(shards)]
+    with os.scandir(path) as entries:
+        return sorted({e.name if e.is_dir() else '.' for e in entries})
+
+
+# With --shard-by hash, --path is listed once and photos are put in buckets, one per shard.
+def list_hash_buckets(path, shards):
+    buckets = {'hash-%i' % i: [] for i in range(shards)}
+    for f in PhotosSync.find_local_photos(path):
+        # zlib.crc32 rather than hash() which is randomized per process
+        buckets['hash-%i' % (zlib.crc32(os.path.relpath(f, path).encode()) % shards)].append(f)
+    return buckets
+
+
+def list_shard_photos(path, shard, shard_by, hash_buckets=None):
+    if shard_by == 'hash':
+        return hash_buckets[shard]
+    if shard == '.':
+        return PhotosSync.find_local_photos(path, recursive=False)
+    return PhotosSync.find_local_photos(os.path.join(path, shard))
+
+
+def run_worker(path, config, store_file, run_id, shard_by, shards, pretend=False, transcoder=None, scheduler=None, update_descriptions=False):
+    store = ShardStore(store_file, run_id)
+    store.add_shards(list_shards(path, shard_by, shards))
+    ps = PhotosSync(shard_store=store)
+    hash_buckets = None
+
+    while True:
+        shard = store.claim_shard()
+        if shard is None:
+            logger.info(f'No shard left to process for run {run_id}')
+            ps.finish_run(pretend=pretend)
+            return
+        logger.info(f"Processing shard '{shard}' of {path}")
+
+        try:
+            with store.keep_shard(shard):
+                if shard_by == 'hash' and hash_buckets is None:
+                    hash_buckets = list_hash_buckets(path, shards)
+                local_photos = list_shard_photos(path, shard, shard_by, hash_buckets)
+                logger.info('%s photos found in shard %s ... ' % (len(local_photos), shard))
+                if local_photos:
+                    ps.local_photos = local_photos
+                    ps.load_local_photos_exif_data()
+                    ps.match_local_photos_to_albums(config)
+                    store.check_shard(shard)  # Don't upload if another worker took over this shard
+                    ps.upload_photos(pretend=pretend, transcoder=transcoder, scheduler=scheduler, stop=lambda: store.shard_lost(shard))
+                    store.check_shard(shard)
+                    if update_descriptions:
+                        ps.update_photos_metadata(pretend=pretend)
+                    ps.create_missing_albums(config, pretend=pretend)
+                    store.check_shard(shard)
+                    ps.add_photos_to_albums(pretend=pretend)
+        except LeaseLostError as e:
+            logger.warning(f'{e}, moving on to next shard')
+            continue
+        store.complete_shard(shard)
+
+
+def run_workers(workers, *args, **kwargs):
+    if workers <= 1:
+        return run_worker(*args, **kwargs)
+
+    processes = [Process(target=run_worker, args=args, kwargs=kwargs) for _ in range(workers)]
+    for p in processes:
+        p.start()
+    for p in processes:
+        p.join()
+    failed = [p for p in processes if p.exitcode != 0]
+    if failed:
+        logger.error(f'{len(failed)} of {workers} workers failed, run again with same --shard-run once their leases expired to process remaining shards.')
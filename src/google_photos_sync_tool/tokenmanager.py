@@ -0,0 +1,99 @@
+"""
+Hand out OAuth access tokens to any number of threads, refreshing them before they expire.
+
+A background thread refreshes the token TOKEN_REFRESH_MARGIN seconds before it expires, so long runs never wait on auth:
+while it does, callers keep getting the current token which is still valid. Callers only wait for a refresh if the
+token expired. If a request still gets a 401, refresh_after_401() refreshes only if nobody refreshed the token since
+this request got it, so N threads getting a 401 at once cause a single refresh and all replay with the new token.
+Refresh requests time out like API calls, a hung token endpoint can't block callers forever.
+"""
+
+import logging
+import threading
+from datetime import datetime, timedelta
+
+from httplib2 import Http
+
+from google_photos_sync_tool.config import TOKEN_REFRESH_MARGIN
+
+logger = logging.getLogger()
+
+
+class TokenManager:
+    def __init__(self, credentials, refresh_margin=TOKEN_REFRESH_MARGIN, timeout=None):
+        self.credentials = credentials  # oauth2client credentials, refreshed ones are saved in their store (credentials.json)
+        self.refresh_margin = timedelta(seconds=refresh_margin)
+        self.timeout = timeout  # Seconds, of refresh requests
+        self.lock = threading.Lock()  # Held while refreshing, so there's one refresh at a time
+        self.stop_event = threading.Event()
+        self.refresher = None
+
+    def start(self):
+        self.refresher = threading.Thread(target=self.__keep_refreshing, daemon=True)
+        self.refresher.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def __expires_within(self, margin):
+        # oauth2client stores token_expiry as naive UTC datetime, None if unknown.
+        expiry = self.credentials.token_expiry
+        return not self.credentials.access_token or (expiry is not None and datetime.utcnow() + margin >= expiry)
+
+    def __refresh(self):
+        logger.debug('Refreshing access token, it expires at %s UTC' % self.credentials.token_expiry)
+        self.credentials.refresh(Http(timeout=self.timeout))
+
+    # Doesn't wait for a refresh in progress as long as current token is still valid.
+    def get_token(self):
+        if not self.__expires_within(timedelta(0)):
+            return self.credentials.access_token
+        with self.lock:
+            if self.__expires_within(timedelta(0)):
+                self.__refresh()
+            return self.credentials.access_token
+
+    # 'stale_token' is the token that got a 401.
+    def refresh_after_401(self, stale_token):
+        with self.lock:
+            if self.credentials.access_token == stale_token:
+                self.__refresh()
+            return self.credentials.access_token
+
+    def __keep_refreshing(self):
+        while True:
+            expiry = self.credentials.token_expiry
+            wait = (expiry - self.refresh_margin - datetime.utcnow()).total_seconds() if expiry else 60
+            if self.stop_event.wait(max(wait, 1)):
+                return
+            try:
+                with self.lock:
+                    if self.__expires_within(self.refresh_margin):
+                        self.__refresh()
+            except Exception as e:
+                logger.warning(f'Failed to refresh access token in background, will retry: {e}')
+                if self.stop_event.wait(30):
+                    return
+
+    def authorize(self, http):
+        return _AuthorizedHttp(http, self)
+
+
+# Drop-in replacement for httplib2.Http used by apiclient, adds current token to requests and replays once on 401.
+class _AuthorizedHttp:
+    def __init__(self, http, token_manager):
+        self.http = http
+        self.token_manager = token_manager
+
+    def request(self, uri, method='GET', body=None, headers=None, *args, **kwargs):
+        headers = dict(headers or {})
+        token = self.token_manager.get_token()
+        headers['Authorization'] = 'Bearer ' + token
+        resp, content = self.http.request(uri, method, body, headers, *args, **kwargs)
+        if resp.status == 401:
+            headers['Authorization'] = 'Bearer ' + self.token_manager.refresh_after_401(token)
+            resp, content = self.http.request(uri, method, body, headers, *args, **kwargs)
+        return resp, content
+
+    def __getattr__(self, name):
+        return getattr(self.http, name)
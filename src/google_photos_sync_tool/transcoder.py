@@ -0,0 +1,149 @@
+"""
+Optional pre-upload stage that downscales and re-encodes photos before they are uploaded.
+
+Google Photos only keeps "storage saver" copies anyway, so there is no point sending 20MB originals over the wire.
+Transcoding runs in a process pool, metadata (EXIF/IPTC/XMP) is copied over from the original with exiftool,
+and transcoded files are written to a temporary directory which never holds more than 'max_pending_files' at once.
+Concurrent uploads (batch jobs) share the same pool, so there are never more than 'workers' transcoding processes.
+"""
+
+import atexit
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, wait
+from itertools import count
+
+import exiftool
+from PIL import Image
+
+from google_photos_sync_tool.config import TRANSCODE_MAX_RESOLUTION, TRANSCODE_QUALITY, TRANSCODE_WORKERS, TRANSCODE_MAX_PENDING_FILES
+
+logger = logging.getLogger()
+
+# One exiftool process per worker, started by the pool initializer, spawning exiftool for every photo is too slow.
+_worker_exiftool = None
+
+
+def _init_worker():
+    global _worker_exiftool
+    _worker_exiftool = exiftool.ExifTool()
+    _worker_exiftool.start()
+    atexit.register(_worker_exiftool.terminate)
+
+
+def _transcode_file(src, dst, max_resolution, quality):
+    with Image.open(src) as img:
+        img.thumbnail((max_resolution, max_resolution))  # Keeps aspect ratio and never upscales
+        # exiftool doesn't copy ICC_Profile with -all:all (it's an "unsafe" tag), without it colors of wide gamut photos shift.
+        img.save(dst, 'JPEG', quality=quality, optimize=True, icc_profile=img.info.get('icc_profile'))
+    # Copy all metadata from original, Pillow would drop IPTC and XMP blocks.
+    _worker_exiftool.execute(b'-tagsFromFile', os.fsencode(src), b'-all:all', b'-overwrite_original', os.fsencode(dst))
+    return os.path.getsize(src), os.path.getsize(dst)
+
+
+class Transcoder:
+    def __init__(self, max_resolution=TRANSCODE_MAX_RESOLUTION, quality=TRANSCODE_QUALITY, workers=TRANSCODE_WORKERS, max_pending_files=TRANSCODE_MAX_PENDING_FILES):
+        self.max_resolution = max_resolution
+        self.quality = quality
+        self.workers = workers
+        self.max_pending_files = max_pending_files
+        self.bytes_in = 0
+        self.bytes_out = 0
+        # Concurrent transcode() calls (e.g: batch jobs) share one process pool, it's shut down when the last one ends.
+        self.lock = threading.Lock()
+        self.executor = None
+        self.executor_users = 0
+
+    # Locks and pools can't be pickled, sharded workers started with 'spawn' (see sharding.py) get a pickled copy.
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state['lock']
+        state.update(executor=None, executor_users=0)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def __acquire_executor(self):
+        with self.lock:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker)
+            self.executor_users += 1
+            return self.executor
+
+    def __release_executor(self):
+        with self.lock:
+            self.executor_users -= 1
+            if self.executor_users:
+                return
+            executor, self.executor = self.executor, None
+        executor.shutdown()
+
+    # Yield photos with 'upload_file_path' set to their transcoded copy, in the same order as 'photos'.
+    # Caller must call release() once a photo is uploaded so that the next ones can be transcoded.
+    # At most 'max_pending_files' transcoded files wait to be uploaded per call.
+    def transcode(self, photos):
+        tmp_dir = tempfile.mkdtemp(prefix='google_photos_sync_tool-')
+        logger.info(f'Transcoding photos to max {self.max_resolution}px, quality {self.quality} in {tmp_dir} ...')
+        t0 = time.time()
+        bytes_in, bytes_out = 0, 0
+        pending = deque()
+        photos_iter = iter(photos)
+        file_ids = count()
+        executor = self.__acquire_executor()
+        try:
+            def submit_next():
+                p = next(photos_iter, None)
+                if p is None:
+                    return False
+                dst = os.path.join(tmp_dir, '%i.jpg' % next(file_ids))
+                pending.append((p, dst, executor.submit(_transcode_file, p.file_path, dst, self.max_resolution, self.quality)))
+                return True
+
+            while len(pending) < self.max_pending_files and submit_next():
+                pass
+
+            while pending:
+                p, dst, future = pending.popleft()
+                try:
+                    size_in, size_out = future.result()
+                except Exception as e:
+                    logger.warning(f'Failed to transcode {p.short_file_path}, uploading original instead: {e}')
+                    size_in, size_out = None, None
+
+                if size_out is not None and size_out < size_in:
+                    p.upload_file_path = dst
+                    bytes_in += size_in
+                    bytes_out += size_out
+                    logger.debug(f'Transcoded {p.short_file_path} from {size_in} to {size_out} bytes')
+                elif os.path.exists(dst):
+                    os.remove(dst)  # Transcoded copy isn't smaller, upload original
+
+                yield p
+                submit_next()
+        finally:
+            # Pool is shared, only wait for this call's photos, they must not be written once tmp_dir is removed.
+            for _, _, future in pending:
+                future.cancel()
+            wait([future for _, _, future in pending])
+            self.__release_executor()
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        with self.lock:
+            self.bytes_in += bytes_in
+            self.bytes_out += bytes_out
+        if bytes_in:
+            td = (time.time() - t0)
+            logger.info('Transcoded {0:.1f}MB down to {1:.1f}MB ({2:.1f}x) in {3:.2f}s'.format(bytes_in / 2**20, bytes_out / 2**20, bytes_in / bytes_out, td))
+
+    @staticmethod
+    def release(photo):
+        if photo.upload_file_path:
+            os.remove(photo.upload_file_path)
+            photo.upload_file_path = None
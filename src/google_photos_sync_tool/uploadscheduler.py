@@ -0,0 +1,203 @@
+"""
+Decide in which order photos get uploaded, how fast and how many of them in a single run.
+
+Bandwidth limits are either a plain rate ('500K') or a rate for a time of day window ('08:00-18:00=200K'),
+first matching window wins, a plain rate applies outside of windows, no limit if nothing matches or if rate is 0.
+Photos that don't fit in --max-upload-bytes / --max-upload-time are deferred, next run will pick them up.
+"""
+
+import logging
+import os
+import re
+import threading
+import time
+from datetime import datetime
+
+logger = logging.getLogger()
+
+UPLOAD_ORDERS = ('newest-first', 'oldest-first', 'smallest-first', 'album-priority')
+SIZE_UNITS = {'': 1, 'K': 2**10, 'M': 2**20, 'G': 2**30}
+
+
+def parse_size(size):
+    m = re.fullmatch(r'\s*([0-9.]+)\s*([KMG]?)B?\s*', str(size), re.IGNORECASE)
+    if not m:
+        raise ValueError(f"Invalid size '{size}', expected something like 500K, 20M or 2G")
+    return int(float(m.group(1)) * SIZE_UNITS[m.group(2).upper()])
+
+
+def format_size(size):
+    return '{0:.1f}MB'.format(size / 2**20)
+
+
+# Returns (start_minute, end_minute, bytes_per_second), start_minute and end_minute are None for a plain rate.
+def parse_bandwidth_limit(limit):
+    m = re.fullmatch(r'([0-9]{1,2}):([0-9]{2})-([0-9]{1,2}):([0-9]{2})=(.+)', limit.strip())
+    if not m:
+        return None, None, parse_size(limit)
+    if int(m.group(1)) > 23 or int(m.group(3)) > 23 or int(m.group(2)) > 59 or int(m.group(4)) > 59:
+        raise ValueError(f"Invalid time of day in '{limit}', expected something like 08:00-18:00=500K")
+    return int(m.group(1)) * 60 + int(m.group(2)), int(m.group(3)) * 60 + int(m.group(4)), parse_size(m.group(5))
+
+
+# argparse type of --bandwidth-limit, limits are kept as given so they can be shown as is.
+def bandwidth_limit(limit):
+    parse_bandwidth_limit(limit)
+    return limit
+
+
+# Returns {album name: 'UploadPriority'} of albums mapping, raises ValueError if one isn't an integer.
+def album_priorities(albums_mapping):
+    priorities = {}
+    for album_name, album_mapping in albums_mapping.items():
+        try:
+            priorities[album_name] = int(album_mapping.get('UploadPriority', 0))
+        except ValueError:
+            raise ValueError(f"'UploadPriority' of '{album_name}' must be an integer, not '{album_mapping['UploadPriority']}'")
+    return priorities
+
+
+class BandwidthSchedule:
+    def __init__(self, limits=()):
+        self.windows = []  # (start_minute, end_minute, bytes_per_second)
+        self.default_rate = None
+        for limit in limits:
+            start, end, rate = parse_bandwidth_limit(limit)
+            if start is None:
+                self.default_rate = rate
+            else:
+                self.windows.append((start, end, rate))
+        self.limits = list(limits)
+
+    # Returns bytes per second allowed at 'dt', None means no limit.
+    def rate_at(self, dt):
+        minute = dt.hour * 60 + dt.minute
+        for (start, end, rate) in self.windows:
+            if start <= minute < end or (end < start and (minute >= start or minute < end)):  # Window can wrap around midnight
+                return rate
+        return self.default_rate
+
+    def __repr__(self):
+        return ', '.join(self.limits) if self.limits else 'unlimited'
+
+
+class UploadScheduler:
+    def __init__(self, bandwidth_schedule=None, order='newest-first', album_priorities=None, max_bytes=None, max_duration=None):
+        if order not in UPLOAD_ORDERS:
+            raise ValueError(f"Unknown upload order '{order}', expected one of {', '.join(UPLOAD_ORDERS)}")
+        self.bandwidth_schedule = bandwidth_schedule or BandwidthSchedule()
+        self.order = order
+        self.album_priorities = album_priorities or {}
+        self.max_bytes = max_bytes
+        self.max_duration = max_duration
+        self.deferred = set()
+        self.t_start = None  # When first upload of this run started, time budget is for the whole run
+        self.bytes_reserved = 0  # Bytes of uploads started, counted against max_bytes
+        self.bytes_sent = 0
+        self.upload_duration = 0
+        self.simulated_duration = 0  # Estimated duration of uploads simulated with --pretend
+        self._next_send_ts = 0
+        self.lock = threading.Lock()  # Shared by concurrent uploads (e.g: batch jobs)
+
+    # Locks can't be pickled, sharded workers started with 'spawn' (see sharding.py) get a pickled copy.
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    # 'album_priorities' overrides the scheduler's ones, e.g: batch jobs each have their own albums mapping.
+    def sort(self, photos, photos_per_albums, album_priorities=None):
+        if self.order == 'newest-first':
+            return sorted(photos, reverse=True)
+        if self.order == 'oldest-first':
+            return sorted(photos)
+        if self.order == 'smallest-first':
+            return sorted(photos, key=lambda p: os.path.getsize(p.file_path))
+
+        # album-priority: photo gets the priority of the highest priority album it belongs to, newest first within same priority.
+        album_priorities = self.album_priorities if album_priorities is None else album_priorities
+        photo_priorities = {}
+        for album_name, album_photos in photos_per_albums.items():
+            for p in album_photos:
+                photo_priorities[p] = max(photo_priorities.get(p, 0), album_priorities.get(album_name, 0))
+        return sorted(sorted(photos, reverse=True), key=lambda p: photo_priorities.get(p, 0), reverse=True)
+
+    # Stop yielding photos once this run's time budget is used, remaining ones are left for next run.
+    # Called by each upload(), time budget starts with the first one and is shared by all of them (shards of a worker, batch jobs).
+    def start(self):
+        with self.lock:
+            if self.t_start is None:
+                self.t_start = time.time()
+        logger.info(f'Uploading {self.order}, bandwidth limit: {self.bandwidth_schedule}')
+
+    # Returns True once this run's time budget is used, checked before each upload.
+    # With --pretend, nothing is uploaded so estimated duration of simulated uploads is counted instead.
+    def out_of_time(self, pretend=False):
+        if not self.max_duration or self.t_start is None:
+            return False
+        return (self.simulated_duration if pretend else time.time() - self.t_start) >= self.max_duration
+
+    # Reserves 'size' bytes of this run's byte budget, returns False if they don't fit.
+    # Reserving is atomic, so concurrent uploads can't all fit and overshoot the budget together.
+    def fits(self, size):
+        with self.lock:
+            if self.max_bytes and self.bytes_reserved + size > self.max_bytes:
+                return False
+            self.bytes_reserved += size
+            return True
+
+    def record_simulated(self, duration):
+        with self.lock:
+            self.simulated_duration += duration
+
+    def throttle(self, data):
+        return _ThrottledReader(data, self)
+
+    def record(self, size, duration):
+        with self.lock:
+            self.bytes_sent += size
+            self.upload_duration += duration
+
+    # Sleep as needed so that sending 'size' more bytes stays within current bandwidth limit.
+    def _pace(self, size):
+        rate = self.bandwidth_schedule.rate_at(datetime.now())
+        if not rate:
+            return
+        with self.lock:
+            self._next_send_ts = max(self._next_send_ts, time.monotonic()) + size / rate
+        delay = self._next_send_ts - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def report(self):
+        if self.upload_duration:
+            logger.info('Uploaded {0} in {1:.2f}s, achieved {2}/s (bandwidth limit: {3})'.format(
+                format_size(self.bytes_sent), self.upload_duration, format_size(self.bytes_sent / self.upload_duration), self.bandwidth_schedule))
+        if self.deferred:
+            logger.info(f'{len(self.deferred)} photos did not fit in this run budget, they will be uploaded next run.')
+
+
+# File-like object that requests streams from, reads are paced to respect the bandwidth limit.
+class _ThrottledReader:
+    CHUNK_SIZE = 64 * 2**10
+
+    def __init__(self, data, scheduler):
+        self.data = data
+        self.offset = 0
+        self.scheduler = scheduler
+
+    def __len__(self):
+        return len(self.data)
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = len(self.data) - self.offset
+        chunk = self.data[self.offset:self.offset + min(size, self.CHUNK_SIZE)]
+        self.offset += len(chunk)
+        if chunk:
+            self.scheduler._pace(len(chunk))
+        return chunk
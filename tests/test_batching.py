@@ -0,0 +1,78 @@
+# pytest tests/test_batching.py
+
+from googleapiclient import errors
+from httplib2 import Response
+import pytest
+
+from google_photos_sync_tool.batching import BatchRunner
+
+
+class TestBatchRunner(object):
+    # Fake batch API call failing whole batches containing a bad item, and reporting per-item failure for flaky ones once.
+    @pytest.fixture
+    def api(self):
+        api = {'batches': [], 'flaky_failures': set()}
+
+        def call(batch):
+            api['batches'].append(list(batch))
+            if any(item.startswith('bad') for item in batch):
+                raise errors.HttpError(Response({'status': 400}), b'invalid media item id')
+            outcomes = []
+            for item in batch:
+                if item.startswith('flaky') and item not in api['flaky_failures']:
+                    api['flaky_failures'].add(item)
+                    outcomes.append((False, None, 'flaky'))
+                else:
+                    outcomes.append((True, item.upper(), None))
+            return outcomes
+        api['call'] = call
+        return api
+
+    def test_all_succeed_in_max_size_batches(self, api):
+        items = ['id%i' % i for i in range(120)]
+        results = BatchRunner('test', api['call'], 50, 3).run(items)
+        assert [len(b) for b in api['batches']] == [50, 50, 20]
+        assert all(r.ok for r in results)
+        assert [r.result for r in results] == [i.upper() for i in items]
+
+    def test_bad_item_is_isolated(self, api):
+        items = ['id%i' % i for i in range(40)] + ['bad'] + ['id%i' % i for i in range(40, 60)]
+        results = BatchRunner('test', api['call'], 50, 3).run(items)
+        assert [r.item for r in results if not r.ok] == ['bad']
+        assert sum(1 for r in results if r.ok) == 60
+        assert sum(1 for b in api['batches'] if b == ['bad']) == 1  # Failed once alone, never retried
+        assert len(api['batches']) < 20
+
+    def test_only_failed_items_are_retried(self, api):
+        items = ['id0', 'flaky1', 'id2', 'flaky3']
+        results = BatchRunner('test', api['call'], 50, 3).run(items)
+        assert all(r.ok for r in results)
+        assert api['batches'] == [items, ['flaky1', 'flaky3']]
+
+    @pytest.mark.parametrize("status", [429, 500])
+    def test_quota_or_server_error_is_not_split(self, status):
+        batches = []
+
+        def call(batch):
+            batches.append(list(batch))
+            raise errors.HttpError(Response({'status': status}), b'try again later')
+
+        items = ['id%i' % i for i in range(120)]
+        results = BatchRunner('test', call, 50, 3, backoff=0).run(items)
+        assert [len(b) for b in batches] == [50, 50, 50]  # Same batch retried, never split, then give up
+        assert len(results) == 120 and not any(r.ok for r in results)
+
+    def test_auth_error_is_not_retried(self):
+        batches = []
+
+        def call(batch):
+            batches.append(list(batch))
+            raise errors.HttpError(Response({'status': 403}), b'forbidden')
+
+        results = BatchRunner('test', call, 50, 3, backoff=0).run(['id%i' % i for i in range(10)])
+        assert len(batches) == 1
+        assert not any(r.ok for r in results)
+
+    def test_pretend_makes_no_call(self, api):
+        assert BatchRunner('test', api['call'], 50, 3).run(['id0'], pretend=True) == []
+        assert api['batches'] == []
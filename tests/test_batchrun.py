@@ -0,0 +1,49 @@
+# pytest tests/test_batchrun.py
+
+from datetime import datetime, date
+
+from google_photos_sync_tool.batchrun import SharedGooglePhotosClient
+
+
+class FakeClient(object):
+    def __init__(self):
+        self.searches = []
+        self.album_listings = 0
+
+    def search_items_by_date_range(self, datetime_from=None, datetime_to=None):
+        self.searches.append((datetime_from, datetime_to))
+        return iter([{'id': f'{datetime_from}:{datetime_to}'}])
+
+    def list_albums(self):
+        self.album_listings += 1
+        return [{'id': 'a', 'title': 'A'}]
+
+
+class TestSharedGooglePhotosClient(object):
+    def test_overlapping_date_ranges_are_searched_once(self):
+        client = FakeClient()
+        shared = SharedGooglePhotosClient(client)
+        shared.prefetch_date_ranges([(datetime(2019, 1, 1), datetime(2019, 3, 1)),
+                                     (datetime(2019, 2, 1), datetime(2019, 4, 1)),
+                                     (datetime(2019, 4, 2), datetime(2019, 5, 1)),
+                                     (datetime(2020, 1, 1), datetime(2020, 2, 1))])
+        assert client.searches == [(date(2019, 1, 1), date(2019, 5, 1)), (date(2020, 1, 1), date(2020, 2, 1))]
+
+        items = shared.search_items_by_date_range(datetime(2019, 2, 1), datetime(2019, 3, 1))
+        assert len(client.searches) == 2
+        assert items == [{'id': '2019-01-01:2019-05-01'}]
+
+    def test_only_missing_date_ranges_are_searched(self):
+        client = FakeClient()
+        shared = SharedGooglePhotosClient(client)
+        shared.search_items_by_date_range(datetime(2019, 2, 1), datetime(2019, 2, 28))
+        items = shared.search_items_by_date_range(datetime(2019, 1, 1), datetime(2019, 3, 31))
+        assert client.searches[1:] == [(date(2019, 1, 1), date(2019, 1, 31)), (date(2019, 3, 1), date(2019, 3, 31))]
+        assert len(items) == 3
+
+    def test_albums_are_listed_once(self):
+        client = FakeClient()
+        shared = SharedGooglePhotosClient(client)
+        shared.list_albums()
+        assert shared.list_albums() == [{'id': 'a', 'title': 'A'}]
+        assert client.album_listings == 1
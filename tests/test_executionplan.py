@@ -0,0 +1,56 @@
+# pytest tests/test_executionplan.py
+
+import logging
+import os
+
+from google_photos_sync_tool.executionplan import ExecutionPlan, RunStats
+
+
+class TestRunStats(object):
+    def test_concurrent_runs_measurements_are_merged(self, tmp_path):
+        stats_file = str(tmp_path / 'stats.json')
+        worker_a, worker_b = RunStats(stats_file), RunStats(stats_file)  # Both started before any saved
+        worker_a.record_calls('albums.list', 2, 1.0)
+        worker_a.record_upload(1000, 2.0)
+        worker_b.record_calls('albums.list', 1, 0.5)
+        worker_a.save()
+        worker_b.save()
+        worker_b.save()  # Saving again doesn't count measurements twice
+
+        stats = RunStats(stats_file)
+        assert stats.calls == {'albums.list': {'count': 3, 'seconds': 1.5}}
+        assert stats.upload_rate() == 500
+        assert sorted(os.listdir(str(tmp_path))) == ['stats.json', 'stats.json.lock']
+
+
+class TestExecutionPlan(object):
+    def report(self, plan, run_stats, caplog):
+        caplog.set_level(logging.INFO)
+        plan.report(run_stats)
+        return [r.getMessage() for r in caplog.records]
+
+    def test_report_estimates_duration_and_quota(self, tmp_path, caplog):
+        run_stats = RunStats(str(tmp_path / 'stats.json'))
+        run_stats.record_upload(2**20, 10.0)
+        run_stats.record_calls('mediaItems.batchCreate', 1, 2.0)
+        plan = ExecutionPlan()
+        for _ in range(3):
+            plan.add_upload(2**20)
+        plan.add_deferred(2 * 2**20)
+        plan.add_calls('mediaItems.batchCreate', 1)
+        plan.add_calls('albums.batchAddMediaItems', 1)
+
+        report = self.report(plan, run_stats, caplog)
+        assert '  3 photos to upload, 3.0MB' in report
+        assert '  1 photos, 2.0MB, left for next run, they do not fit in this run budget' in report
+        assert '  3 v1/uploads calls' in report
+        # 3 x 10s of uploads and 2s of batchCreate, albums.batchAddMediaItems was never measured
+        assert '  Estimated duration: 0.5min (not counting albums.batchAddMediaItems, never measured by a previous run)' in report
+        assert '  Estimated API quota usage: 5 requests, 0.1% of daily quota (10000)' in report
+
+    def test_report_warns_when_quota_exceeded(self, tmp_path, caplog):
+        plan = ExecutionPlan()
+        plan.add_calls('mediaItems.patch', 10001)
+        report = self.report(plan, RunStats(str(tmp_path / 'stats.json')), caplog)
+        assert '  Estimated duration: 0.0min (not counting mediaItems.patch, never measured by a previous run)' in report
+        assert report[-1] == 'This run would exceed daily API quota!'
@@ -1,11 +1,16 @@
 # pytest tests/test_google_photos_sync_tool.py
 
+import os
+
 from mock import patch
 import pytest
 
+from google_photos_sync_tool.batching import BatchItemResult
 from google_photos_sync_tool.config import Config
+from google_photos_sync_tool.googlephotosclient import MAX_DESCRIPTION_LENGTH
 from google_photos_sync_tool.photossync import PhotosSync
 from google_photos_sync_tool.photo import Photo
+from google_photos_sync_tool.scanstate import ScanState
 
 
 class TestPhotosSync(object):
@@ -64,3 +69,94 @@ class TestPhotosSync(object):
     @pytest.mark.parametrize("expected", photos_per_albums_expected)
     def test_match_local_photos_to_albums(self, ps, expected):
         assert ps.photos_to_upload_per_albums == expected
+
+
+# GooglePhotosClient stand-in, items whose google_id starts with 'not-mine' can't be updated nor added to albums.
+class FakeClient(object):
+    def __init__(self):
+        self.updated = []
+        self.run_stats = FakeRunStats()
+
+    def update_items_description(self, items, pretend=False):
+        self.updated += items
+        failed = sum(1 for google_id, _ in items if google_id.startswith('not-mine'))
+        return len(items) - failed, failed
+
+    def add_items_to_album(self, photos, album_id, pretend=False):
+        return [BatchItemResult(p, not p.googleId.startswith('not-mine'), None, None) for p in photos if p.googleId]
+
+
+class FakeRunStats(object):
+    def save(self):
+        pass
+
+
+class TestUpdatePhotosMetadata(object):
+    @staticmethod
+    def exif_data(name, tags=None):
+        exif_data = {'SourceFile': f'/home/me/Photos/{name}', 'EXIF:DateTimeOriginal': '2019:04:09 11:12:51', 'EXIF:OffsetTimeOriginal': '+02:00'}
+        exif_data.update(tags or {})
+        return exif_data
+
+    @pytest.fixture
+    def ps(self):
+        ps = PhotosSync(google_photos_client=FakeClient())
+        ps.local_photos_exif_data = [
+            self.exif_data('caption.jpg', {'IPTC:Keywords': ['green', 'family'], 'IPTC:Caption-Abstract': 'Picnic'}),
+            self.exif_data('keywords.jpg', {'IPTC:Keywords': ['green', 'family']}),
+            self.exif_data('keyword.jpg', {'IPTC:Keywords': 'green'}),
+            self.exif_data('long.jpg', {'IPTC:Caption-Abstract': 'x' * (MAX_DESCRIPTION_LENGTH + 1)}),
+            self.exif_data('none.jpg'),
+        ]
+        config = Config('tests/data/albums.yaml')
+        config.albums_mapping = {'All': {'FilePath': '.*'}}
+        ps.match_local_photos_to_albums(config)
+        return ps
+
+    def test_description_is_caption_or_keywords(self, ps):
+        descriptions = {p.short_file_path: p.description for p in ps.photos_to_upload}
+        assert descriptions == {
+            'caption.jpg': 'Picnic',  # Caption wins over keywords
+            'keywords.jpg': 'green, family',
+            'keyword.jpg': 'green',
+            'long.jpg': 'x' * MAX_DESCRIPTION_LENGTH,
+            'none.jpg': '',
+        }
+
+    def test_only_stale_descriptions_are_updated(self, ps):
+        ps.photos_already_uploaded = {
+            Photo(short_file_path='caption.jpg', googleId='1', googleDescription='green, family'),  # Caption added since
+            Photo(short_file_path='keywords.jpg', googleId='2', googleDescription='green, family'),
+            Photo(short_file_path='keyword.jpg', googleId='not-mine-3', googleDescription='red'),
+            Photo(short_file_path='none.jpg', googleId='5', googleDescription=None),  # No description is the same as empty one
+        }
+        assert ps.update_photos_metadata() == (1, 2, 1)
+        assert sorted(ps.google_photos_client.updated) == [('1', 'Picnic'), ('not-mine-3', 'green')]
+
+    def test_nothing_to_update(self, ps):
+        ps.photos_already_uploaded = {Photo(short_file_path='keyword.jpg', googleId='3', googleDescription='green')}
+        assert ps.update_photos_metadata() == (0, 1, 0)
+        assert ps.google_photos_client.updated == []
+
+
+class TestIncrementalRun(object):
+    def test_photos_not_added_to_albums_are_synced_next_run(self, tmp_path):
+        photos_dir = tmp_path / 'photos'
+        photos_dir.mkdir()
+        for name in ['a.jpg', 'b.jpg', 'c.jpg']:
+            (photos_dir / name).write_text(name)
+        albums_mapping = {'Green': {'FilePath': '.*'}}
+        state_file = str(tmp_path / 'state.json')
+
+        ps = PhotosSync(scan_state=ScanState(albums_mapping, state_file=state_file), google_photos_client=FakeClient())
+        ps.list_local_photos(str(photos_dir))
+        # As if a.jpg and b.jpg were uploaded, c.jpg failed to upload
+        photos = {Photo(file_path=str(photos_dir / name), googleId=google_id) for name, google_id in [('a.jpg', '1'), ('b.jpg', 'not-mine-2'), ('c.jpg', None)]}
+        ps.photos_to_upload = photos
+        ps.photos_to_upload_per_albums = {'Green': photos}
+        ps.google_photos_albums = [{'id': 'green', 'title': 'Green'}]
+        ps.add_photos_to_albums()
+        ps.finish_run()
+
+        _, changed_photos = ScanState(albums_mapping, state_file=state_file).scan(str(photos_dir))
+        assert sorted(os.path.basename(p) for p in changed_photos) == ['b.jpg', 'c.jpg']
@@ -0,0 +1,126 @@
+# pytest tests/test_googlephotosclient.py
+
+import os
+import threading
+
+import httplib2
+import pytest
+from googleapiclient import errors
+
+from google_photos_sync_tool.executionplan import ExecutionPlan, RunStats
+from google_photos_sync_tool.googlephotosclient import GooglePhotosClient, RateLimiter
+from google_photos_sync_tool.photo import Photo
+from google_photos_sync_tool.uploadscheduler import UploadScheduler
+
+
+# Stands for apiclient's service, records mediaItems.patch calls, items not uploaded by this app can't be updated.
+class FakeService(object):
+    def __init__(self):
+        self.patched = []
+
+    def mediaItems(self):
+        return self
+
+    def patch(self, id=None, updateMask=None, body=None):
+        return FakeRequest(self, (id, body['description']))
+
+
+class FakeRequest(object):
+    def __init__(self, service, patch):
+        self.service = service
+        self.patch = patch
+
+    def execute(self, http=None, num_retries=0):
+        if self.patch[0].startswith('not-mine'):
+            raise errors.HttpError(httplib2.Response({'status': 403}), b'No permission to update media item')
+        self.service.patched.append(self.patch)
+        return {}
+
+
+# GooglePhotosClient without authentication, it makes its API calls to a FakeService.
+@pytest.fixture
+def new_client(tmp_path):
+    def new_client(max_description_updates=0):
+        client = GooglePhotosClient.__new__(GooglePhotosClient)
+        client.service = FakeService()
+        client.rate_limiter = RateLimiter(calls_per_second=1000)
+        client._GooglePhotosClient__thread_http = lambda: None
+        client.stats_lock = threading.Lock()
+        client.description_updates_left = max_description_updates
+        client.plan = ExecutionPlan()
+        client.run_stats = RunStats(str(tmp_path / 'stats.json'))
+        return client
+    return new_client
+
+
+class TestUpdateItemsDescription(object):
+    items = [(str(i), f'description {i}') for i in range(5)]
+
+    def test_updates_are_capped_per_run(self, new_client):
+        client = new_client(max_description_updates=3)
+        assert client.update_items_description(self.items) == (3, 0)
+        assert client.update_items_description(self.items[3:]) == (0, 0)  # Cap is shared by all calls of a run
+        assert sorted(client.service.patched) == self.items[:3]
+
+        next_run = new_client(max_description_updates=3)
+        assert next_run.update_items_description(self.items[3:]) == (2, 0)  # Still stale on next run
+        assert sorted(next_run.service.patched) == self.items[3:]
+
+    def test_failed_updates_are_counted(self, new_client):
+        client = new_client(max_description_updates=10)
+        assert client.update_items_description(self.items[:2] + [('not-mine', 'description')]) == (2, 1)
+
+    def test_capped_updates_are_simulated(self, new_client):
+        client = new_client(max_description_updates=3)
+        assert client.update_items_description(self.items, pretend=True) == (0, 0)
+        assert client.plan.calls['mediaItems.patch'] == 3
+        assert client.service.patched == []
+
+
+# Transcoder stand-in, transcoded copies are 100 bytes.
+class FakeTranscoder(object):
+    def transcode(self, photos):
+        for p in photos:
+            p.upload_file_path = p.file_path + '.small'
+            with open(p.upload_file_path, 'wb') as f:
+                f.write(b'x' * 100)
+            yield p
+
+    @staticmethod
+    def release(photo):
+        os.remove(photo.upload_file_path)
+        photo.upload_file_path = None
+
+
+class TestSimulatedUpload(object):
+    @pytest.fixture
+    def photos(self, tmp_path):
+        photos = []
+        for i in range(3):
+            (tmp_path / f'{i}.jpg').write_bytes(b'x' * 1000)
+            photos.append(Photo(file_path=str(tmp_path / f'{i}.jpg')))
+        return photos
+
+    def test_plan_only_holds_photos_fitting_byte_budget(self, new_client, photos):
+        client = new_client()
+        scheduler = UploadScheduler(max_bytes=2500)
+        client.upload(photos, pretend=True, scheduler=scheduler)
+        assert (client.plan.photos_to_upload, client.plan.bytes_to_upload) == (2, 2000)
+        assert (client.plan.photos_deferred, client.plan.bytes_deferred) == (1, 1000)
+        assert client.plan.calls['mediaItems.batchCreate'] == 1
+        assert scheduler.deferred == {photos[2]}
+
+    def test_plan_only_holds_photos_fitting_time_budget(self, new_client, photos):
+        client = new_client()
+        client.run_stats.record_upload(1000, 1.0)  # 1s per photo
+        scheduler = UploadScheduler(max_duration=1.5)
+        client.upload(photos, pretend=True, scheduler=scheduler)
+        assert client.plan.photos_to_upload == 2
+        assert scheduler.deferred == {photos[2]}
+
+    def test_plan_holds_transcoded_sizes(self, new_client, photos, tmp_path):
+        client = new_client()
+        client.upload(photos, pretend=True, transcoder=FakeTranscoder(), scheduler=UploadScheduler(max_bytes=250))
+        assert (client.plan.photos_to_upload, client.plan.bytes_to_upload) == (2, 200)
+        assert client.plan.photos_deferred == 1
+        assert sorted(os.listdir(str(tmp_path))) == ['0.jpg', '1.jpg', '2.jpg']  # Transcoded copies were removed
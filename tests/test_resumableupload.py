@@ -0,0 +1,123 @@
+# pytest tests/test_resumableupload.py
+
+import json
+import os
+
+from mock import patch
+import pytest
+import requests
+
+from google_photos_sync_tool.resumableupload import ResumableUploader, UPLOAD_URL
+
+
+class FakeTokenManager(object):
+    def get_token(self):
+        return 'token'
+
+    def refresh_after_401(self, stale_token):
+        return 'token'
+
+
+class FakeResponse(object):
+    def __init__(self, status_code=200, headers=None, text=''):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.text = text
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f'{self.status_code} error')
+
+
+# Google Photos resumable upload endpoint, 'interruptions' are offsets at which a chunk is cut (part of it committed).
+class FakeUploadServer(object):
+    def __init__(self):
+        self.sessions = {}
+        self.interruptions = set()
+        self.down = False
+        self.commands = []
+
+    def post(self, url, data=None, headers=None):
+        command = headers['X-Goog-Upload-Command']
+        self.commands.append((command, headers.get('X-Goog-Upload-Offset')))
+        if self.down:
+            raise requests.ConnectionError('connection refused')
+        if command == 'start':
+            assert url == UPLOAD_URL
+            session_url = 'https://upload/%i' % len(self.sessions)
+            self.sessions[session_url] = {'received': b'', 'status': 'active'}
+            return FakeResponse(headers={'X-Goog-Upload-URL': session_url, 'X-Goog-Upload-Chunk-Granularity': '1'})
+
+        session = self.sessions.get(url)
+        if session is None:
+            return FakeResponse(404)
+        if command == 'query':
+            return FakeResponse(headers={'X-Goog-Upload-Status': session['status'], 'X-Goog-Upload-Size-Received': str(len(session['received']))})
+
+        assert int(headers['X-Goog-Upload-Offset']) == len(session['received'])
+        cut = next((o for o in sorted(self.interruptions) if len(session['received']) <= o < len(session['received']) + len(data)), None)
+        if cut is not None:
+            self.interruptions.remove(cut)
+            session['received'] += data[:cut - len(session['received'])]
+            raise requests.ConnectionError('connection reset')
+        session['received'] += data
+        if 'finalize' in command:
+            session['status'] = 'final'
+            return FakeResponse(text='upload-token:%i' % len(session['received']))
+        return FakeResponse()
+
+
+class TestResumableUploader(object):
+    @pytest.fixture
+    def server(self):
+        server = FakeUploadServer()
+        with patch('google_photos_sync_tool.resumableupload.requests.post', server.post):
+            yield server
+
+    @pytest.fixture
+    def video(self, tmp_path):
+        video = tmp_path / 'video.mp4'
+        video.write_bytes(bytes(range(40)))
+        return str(video)
+
+    def uploader(self, tmp_path):
+        return ResumableUploader(FakeTokenManager(), sessions_file=str(tmp_path / 'sessions.json'), chunk_size=4)
+
+    def test_upload_resumes_mid_chunk(self, server, video, tmp_path):
+        server.interruptions = {6}
+        assert self.uploader(tmp_path).upload('video.mp4', video) == 'upload-token:40'
+        assert next(iter(server.sessions.values()))['received'] == bytes(range(40))
+        assert ('upload', '6') in server.commands  # Resumed from what server committed, not from chunk start
+        assert json.loads((tmp_path / 'sessions.json').read_text()) == {}
+
+    def test_retries_are_per_chunk(self, server, video, tmp_path):
+        server.interruptions = set(range(1, 40, 4))  # Every one of the 10 chunks is interrupted once
+        assert self.uploader(tmp_path).upload('video.mp4', video) == 'upload-token:40'
+
+    def test_upload_resumes_from_saved_session(self, server, video, tmp_path):
+        server.interruptions = {10}
+        server.commands = []
+        original_post = server.post
+
+        def post_then_go_down(url, data=None, headers=None):
+            try:
+                return original_post(url, data=data, headers=headers)
+            except requests.ConnectionError:
+                server.down = True  # e.g: network lost until next run
+                raise
+        with patch('google_photos_sync_tool.resumableupload.requests.post', post_then_go_down):
+            assert self.uploader(tmp_path).upload('video.mp4', video) is None
+        assert 'video.mp4' in json.loads((tmp_path / 'sessions.json').read_text())
+
+        server.down = False
+        server.commands = []
+        assert self.uploader(tmp_path).upload('video.mp4', video) == 'upload-token:40'
+        assert server.commands[:2] == [('query', None), ('upload', '10')]
+        assert len(server.sessions) == 1
+
+    def test_expired_session_falls_back_to_new_one(self, server, video, tmp_path):
+        (tmp_path / 'sessions.json').write_text(json.dumps({'video.mp4': {
+            'url': 'https://upload/expired', 'size': 40, 'mtime': os.path.getmtime(video), 'chunk_size': 4}}))
+        assert self.uploader(tmp_path).upload('video.mp4', video) == 'upload-token:40'
+        assert server.commands[:2] == [('query', None), ('start', None)]
+        assert next(iter(server.sessions.values()))['received'] == bytes(range(40))
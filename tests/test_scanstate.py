@@ -0,0 +1,51 @@
+# pytest tests/test_scanstate.py
+
+from google_photos_sync_tool.scanstate import ScanState
+
+
+class TestScanState(object):
+    albums_mapping = {'Green': {'KeywordsIncl': 'green', 'FilePath': '.*'}}
+
+    def scan(self, tmp_path, albums_mapping=albums_mapping):
+        scan_state = ScanState(albums_mapping, state_file=str(tmp_path / 'state.json'))
+        all_photos, changed_photos = scan_state.scan(str(tmp_path / 'photos'))
+        return scan_state, sorted(p[len(str(tmp_path / 'photos')) + 1:] for p in all_photos), sorted(p[len(str(tmp_path / 'photos')) + 1:] for p in changed_photos)
+
+    def test_only_new_photos_are_changed(self, tmp_path):
+        (tmp_path / 'photos' / '2019' / '06').mkdir(parents=True)
+        (tmp_path / 'photos' / '2019' / '06' / 'a.jpg').write_text('a')
+        (tmp_path / 'photos' / 'b.JPG').write_text('b')
+        (tmp_path / 'photos' / 'notes.txt').write_text('c')
+
+        scan_state, all_photos, changed_photos = self.scan(tmp_path)
+        assert all_photos == changed_photos == ['2019/06/a.jpg', 'b.JPG']
+        scan_state.save()
+
+        (tmp_path / 'photos' / '2019' / '06' / 'new.jpg').write_text('new')
+        scan_state, all_photos, changed_photos = self.scan(tmp_path)
+        assert all_photos == ['2019/06/a.jpg', '2019/06/new.jpg', 'b.JPG']
+        assert changed_photos == ['2019/06/new.jpg']
+        assert scan_state.listed_dirs == 1
+
+    def test_forgotten_photos_are_changed_on_next_run(self, tmp_path):
+        (tmp_path / 'photos').mkdir()
+        (tmp_path / 'photos' / 'a.jpg').write_text('a')
+        scan_state, _, _ = self.scan(tmp_path)
+        scan_state.forget([str(tmp_path / 'photos' / 'a.jpg')])
+        scan_state.save()
+
+        _, _, changed_photos = self.scan(tmp_path)
+        assert changed_photos == ['a.jpg']
+
+    def test_all_photos_are_changed_when_albums_mapping_changed(self, tmp_path):
+        (tmp_path / 'photos').mkdir()
+        (tmp_path / 'photos' / 'a.jpg').write_text('a')
+        scan_state, _, _ = self.scan(tmp_path)
+        scan_state.save()
+        assert self.scan(tmp_path)[2] == []
+
+        albums_mapping = dict(self.albums_mapping, Blue={'KeywordsIncl': 'blue', 'FilePath': '.*'})
+        scan_state, _, changed_photos = self.scan(tmp_path, albums_mapping)
+        assert changed_photos == ['a.jpg']
+        scan_state.save()
+        assert self.scan(tmp_path, albums_mapping)[2] == []
@@ -0,0 +1,172 @@
+# pytest tests/test_sharding.py
+
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from google_photos_sync_tool import sharding
+from google_photos_sync_tool.photossync import PhotosSync
+from google_photos_sync_tool.sharding import ShardStore, LeaseLostError, list_shards, list_hash_buckets, list_shard_photos, run_worker
+
+
+class TestShardStore(object):
+    # Two workers sharing a store, owner is normally hostname:pid so it's the same within this test process.
+    @staticmethod
+    def worker(tmp_path, owner, run_id='run1'):
+        store = ShardStore(str(tmp_path / 'shards.sqlite'), run_id, lease_duration=0.5)
+        store.owner = owner
+        store.add_shards(['x', 'y'])
+        return store
+
+    @pytest.fixture
+    def workers(self, tmp_path):
+        return self.worker(tmp_path, 'a'), self.worker(tmp_path, 'b')
+
+    def test_each_shard_is_claimed_once(self, workers, tmp_path):
+        worker_a, worker_b = workers
+        assert worker_a.claim_shard() == 'x'
+        assert worker_b.claim_shard() == 'y'
+        assert self.worker(tmp_path, 'c').claim_shard() is None
+
+    def test_completed_shard_is_not_claimed_again(self, workers, tmp_path):
+        worker_a, worker_b = workers
+        shard = worker_a.claim_shard()
+        worker_a.complete_shard(shard)
+        assert worker_b.claim_shard() == 'y'
+        worker_b.complete_shard('y')
+        assert worker_a.claim_shard() is None
+
+        next_run = ShardStore(str(tmp_path / 'shards.sqlite'), 'run2')
+        next_run.add_shards(['x'])
+        assert next_run.claim_shard() == 'x'  # Shards are tracked per run
+
+    def test_expired_lease_is_taken_over(self, workers):
+        worker_a, worker_b = workers
+        assert worker_a.claim_shard() == 'x'
+        assert worker_b.claim_shard() == 'y'
+        worker_a.check_shard('x')
+        time.sleep(0.6)  # worker_a stopped renewing its lease
+        worker_b.complete_shard('y')
+        assert worker_b.claim_shard() == 'x'
+        assert not worker_a.renew('shard:run1:x')
+        with pytest.raises(LeaseLostError):
+            worker_a.check_shard('x')
+
+    def test_renewed_lease_is_kept(self, workers):
+        worker_a, worker_b = workers
+        assert worker_a.claim_shard() == 'x'
+        with worker_a.keep_shard('x'):
+            time.sleep(0.7)
+            assert worker_b.claim_shard() == 'y'
+            worker_b.complete_shard('y')
+            assert worker_b.claim_shard() is None
+        worker_a.check_shard('x')
+
+    def test_lost_lease_is_flagged(self, workers):
+        worker_a, worker_b = workers
+        assert worker_a.claim_shard() == 'x'
+        with worker_a.keep_shard('x'):
+            worker_b.db.execute("UPDATE leases SET owner = 'b' WHERE name = 'shard:run1:x'")  # Taken over while worker_a was stalled
+            time.sleep(0.4)
+            assert worker_a.shard_lost('x')
+            with pytest.raises(LeaseLostError):
+                worker_a.check_shard('x')
+
+    def test_lease_renewal_is_retried_until_it_expires(self, workers, monkeypatch):
+        worker_a, _ = workers
+        assert worker_a.claim_shard() == 'x'
+        failures = []
+
+        def renew(lease_name, db=None):
+            failures.append(lease_name)
+            if len(failures) == 1 or len(failures) > 3:
+                raise sqlite3.OperationalError('database is locked')
+            return True
+        monkeypatch.setattr(worker_a, 'renew', renew)
+        with worker_a.keep_shard('x'):
+            time.sleep(0.6)
+            assert not worker_a.shard_lost('x')  # First failure was retried
+            time.sleep(0.7)
+            assert worker_a.shard_lost('x')  # Then it couldn't be renewed for longer than the lease
+
+    def test_lock_is_exclusive(self, workers, tmp_path):
+        worker_a, _ = workers
+        events = []
+
+        def lock_b():
+            with self.worker(tmp_path, 'b').lock('albums'):  # sqlite3 connections can't be shared between threads
+                events.append('b locked')
+
+        with worker_a.lock('albums'):
+            thread = threading.Thread(target=lock_b)
+            thread.start()
+            time.sleep(1.5)
+            events.append('a unlocking')
+        thread.join(5)
+        assert events == ['a unlocking', 'b locked']
+
+
+class TestListShards(object):
+    @pytest.fixture
+    def photos_dir(self, tmp_path):
+        for f in ['a.jpg', '2019/b.jpg', '2019/06/c.jpg', 'hash-3/d.jpg', 'hash-x/e.jpg']:
+            (tmp_path / f).parent.mkdir(parents=True, exist_ok=True)
+            (tmp_path / f).write_text(f)
+        return str(tmp_path)
+
+    def test_top_dir_shards(self, photos_dir):
+        shards = list_shards(photos_dir, 'top-dir', 16)
+        assert shards == ['.', '2019', 'hash-3', 'hash-x']
+        assert [f[len(photos_dir) + 1:] for f in list_shard_photos(photos_dir, 'hash-3', 'top-dir')] == ['hash-3/d.jpg']
+        assert [f[len(photos_dir) + 1:] for f in list_shard_photos(photos_dir, 'hash-x', 'top-dir')] == ['hash-x/e.jpg']
+        assert sum(len(list_shard_photos(photos_dir, s, 'top-dir')) for s in shards) == 5
+
+    def test_hash_shards_hold_each_photo_once(self, photos_dir):
+        buckets = list_hash_buckets(photos_dir, 4)
+        assert sorted(buckets) == sorted(list_shards(photos_dir, 'hash', 4))
+        photos = [f for s in buckets for f in list_shard_photos(photos_dir, s, 'hash', buckets)]
+        assert len(photos) == len(set(photos)) == 5
+
+
+# PhotosSync stand-in, uploading to first shard loses its lease.
+class FakePhotosSync(object):
+    find_local_photos = PhotosSync.find_local_photos
+    added_to_albums = []
+
+    def __init__(self, shard_store=None):
+        self.shard_store = shard_store
+
+    def load_local_photos_exif_data(self):
+        pass
+
+    def match_local_photos_to_albums(self, config):
+        pass
+
+    def upload_photos(self, pretend=False, transcoder=None, scheduler=None, stop=None):
+        if self.local_photos[0].endswith('a.jpg'):
+            self.shard_store.db.execute("UPDATE leases SET owner = 'other'")
+
+    def create_missing_albums(self, config, pretend=False):
+        pass
+
+    def add_photos_to_albums(self, pretend=False):
+        self.added_to_albums.extend(self.local_photos)
+
+    def finish_run(self, pretend=False):
+        pass
+
+
+class TestRunWorker(object):
+    def test_worker_moves_on_when_lease_is_lost(self, tmp_path, monkeypatch):
+        photos_dir = tmp_path / 'photos'
+        for f in ['1/a.jpg', '2/b.jpg']:
+            (photos_dir / f).parent.mkdir(parents=True, exist_ok=True)
+            (photos_dir / f).write_text(f)
+        monkeypatch.setattr(sharding, 'PhotosSync', FakePhotosSync)
+        store_file = str(tmp_path / 'shards.sqlite')
+        run_worker(str(photos_dir), None, store_file, 'run1', 'top-dir', 16)
+        assert [f[len(str(photos_dir)) + 1:] for f in FakePhotosSync.added_to_albums] == ['2/b.jpg']
+        done = sqlite3.connect(store_file).execute('SELECT name FROM shards WHERE done = 1').fetchall()
+        assert done == [('2',)]
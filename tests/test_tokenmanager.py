@@ -0,0 +1,100 @@
+# pytest tests/test_tokenmanager.py
+
+import threading
+import time
+from datetime import datetime, timedelta
+
+from httplib2 import Response
+
+from google_photos_sync_tool.tokenmanager import TokenManager
+
+
+# Stands for oauth2client credentials, each refresh gives 'token-<n>' valid for an hour.
+class FakeCredentials(object):
+    def __init__(self, expires_in=3600):
+        self.access_token = 'token-0'
+        self.token_expiry = datetime.utcnow() + timedelta(seconds=expires_in)
+        self.refreshes = 0
+        self.refresh_timeouts = []
+        self.unblock_refresh = threading.Event()
+        self.unblock_refresh.set()
+
+    def refresh(self, http):
+        self.refresh_timeouts.append(http.timeout)
+        self.unblock_refresh.wait()
+        time.sleep(0.1)  # Long enough for concurrent callers to pile up
+        self.refreshes += 1
+        self.access_token = 'token-%i' % self.refreshes
+        self.token_expiry = datetime.utcnow() + timedelta(hours=1)
+
+
+# Stands for httplib2.Http, rejects requests made with 'token-0'.
+class FakeHttp(object):
+    def __init__(self, always_401=False):
+        self.authorizations = []
+        self.always_401 = always_401
+
+    def request(self, uri, method='GET', body=None, headers=None):
+        self.authorizations.append(headers['Authorization'])
+        status = 401 if self.always_401 or headers['Authorization'] == 'Bearer token-0' else 200
+        return Response({'status': status}), b''
+
+
+class TestTokenManager(object):
+    def test_concurrent_401s_cause_one_refresh(self):
+        credentials = FakeCredentials()
+        token_manager = TokenManager(credentials, timeout=60)
+        barrier = threading.Barrier(8)
+        tokens = []
+
+        def on_401():
+            barrier.wait()
+            tokens.append(token_manager.refresh_after_401('token-0'))
+
+        threads = [threading.Thread(target=on_401) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        assert credentials.refreshes == 1
+        assert tokens == ['token-1'] * 8
+        assert credentials.refresh_timeouts == [60]
+
+    def test_expired_token_is_refreshed(self):
+        credentials = FakeCredentials(expires_in=-1)
+        assert TokenManager(credentials).get_token() == 'token-1'
+        assert TokenManager(credentials).get_token() == 'token-1'
+        assert credentials.refreshes == 1
+
+    def test_valid_token_is_handed_out_during_background_refresh(self):
+        credentials = FakeCredentials(expires_in=60)  # Within refresh margin, but still valid
+        credentials.unblock_refresh.clear()  # Token endpoint hangs
+        token_manager = TokenManager(credentials, refresh_margin=300)
+        token_manager.start()
+        try:
+            time.sleep(1.2)  # Background refresh started and is stuck
+            assert credentials.refresh_timeouts
+            tokens = []
+            caller = threading.Thread(target=lambda: tokens.append(token_manager.get_token()), daemon=True)
+            caller.start()
+            caller.join(0.5)
+            assert tokens == ['token-0']
+        finally:
+            token_manager.stop()
+            credentials.unblock_refresh.set()
+        token_manager.refresher.join(5)
+        assert token_manager.get_token() == 'token-1'
+
+
+class TestAuthorizedHttp(object):
+    def test_request_is_replayed_once_with_new_token(self):
+        http = FakeHttp()
+        resp, _ = TokenManager(FakeCredentials()).authorize(http).request('https://photoslibrary.googleapis.com/v1/albums')
+        assert resp.status == 200
+        assert http.authorizations == ['Bearer token-0', 'Bearer token-1']
+
+    def test_request_is_not_replayed_twice(self):
+        http = FakeHttp(always_401=True)
+        resp, _ = TokenManager(FakeCredentials()).authorize(http).request('https://photoslibrary.googleapis.com/v1/albums')
+        assert resp.status == 401
+        assert http.authorizations == ['Bearer token-0', 'Bearer token-1']
@@ -0,0 +1,92 @@
+# pytest tests/test_transcoder.py
+
+import os
+import threading
+
+import exiftool
+from PIL import Image, ImageCms
+import pytest
+
+from google_photos_sync_tool import transcoder as transcoder_module
+from google_photos_sync_tool.photo import Photo
+from google_photos_sync_tool.transcoder import Transcoder
+
+
+class TestTranscoder(object):
+    # Big noisy photo (so it doesn't compress to nothing) with an ICC profile and IPTC keywords of one of test photos.
+    @pytest.fixture
+    def big_photo(self, tmp_path):
+        src = str(tmp_path / 'big.jpg')
+        icc_profile = ImageCms.ImageCmsProfile(ImageCms.createProfile('sRGB')).tobytes()
+        Image.effect_noise((2000, 1000), 64).convert('RGB').save(src, 'JPEG', quality=95, icc_profile=icc_profile)
+        with exiftool.ExifTool() as et:
+            et.execute(b'-tagsFromFile', b'tests/data/kw-green-family.jpg', b'-IPTC:all', b'-overwrite_original', os.fsencode(src))
+        return Photo(file_path=src)
+
+    def test_photo_is_downscaled_and_keeps_metadata(self, big_photo):
+        transcoder = Transcoder(max_resolution=500, quality=80, workers=1)
+        with exiftool.ExifTool() as et:
+            keywords = et.get_tag('IPTC:Keywords', big_photo.file_path)
+            for p in transcoder.transcode([big_photo]):
+                assert p.upload_file_path
+                with Image.open(p.upload_file_path) as img, Image.open(big_photo.file_path) as original:
+                    assert img.size == (500, 250)
+                    assert img.info.get('icc_profile') == original.info['icc_profile']
+                assert et.get_tag('IPTC:Keywords', p.upload_file_path) == keywords
+                assert os.path.getsize(p.upload_file_path) < os.path.getsize(p.file_path)
+                tmp_dir = os.path.dirname(p.upload_file_path)
+                transcoder.release(p)
+        assert keywords
+        assert not os.path.exists(tmp_dir)
+
+    def test_original_is_uploaded_if_not_smaller(self, tmp_path):
+        src = str(tmp_path / 'small.jpg')
+        Image.effect_noise((200, 100), 64).convert('RGB').save(src, 'JPEG', quality=10)
+        photos = [Photo(file_path=src)]
+        transcoded = list(Transcoder(quality=95, workers=1).transcode(photos))
+        assert transcoded == photos
+        assert transcoded[0].upload_file_path is None
+
+    def test_temp_dir_is_removed_when_stopped_early(self, big_photo, tmp_path):
+        photos = [big_photo] + [Photo(file_path='tests/data/kw-red.jpg')] * 3
+        transcoded = Transcoder(max_resolution=500, workers=1).transcode(photos)
+        p = next(transcoded)
+        tmp_dir = os.path.dirname(p.upload_file_path)
+        transcoded.close()
+        assert not os.path.exists(tmp_dir)
+
+
+# Stands for _transcode_file() without exiftool, transcoded copies are 10 bytes.
+def fake_transcode_file(src, dst, max_resolution, quality):
+    with open(dst, 'wb') as f:
+        f.write(b'x' * 10)
+    return os.path.getsize(src), 10
+
+
+class TestSharedTranscoder(object):
+    def test_concurrent_calls_share_one_pool(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(transcoder_module, '_init_worker', lambda: None)
+        monkeypatch.setattr(transcoder_module, '_transcode_file', fake_transcode_file)
+        transcoder = Transcoder(workers=2)
+        executors = []
+        both_started = threading.Barrier(2, timeout=10)
+
+        def job(name):
+            photos = []
+            for i in range(5):
+                (tmp_path / f'{name}{i}.jpg').write_bytes(b'x' * 100)
+                photos.append(Photo(file_path=str(tmp_path / f'{name}{i}.jpg')))
+            for i, p in enumerate(transcoder.transcode(photos)):
+                executors.append(transcoder.executor)
+                transcoder.release(p)
+                if i == 0:
+                    both_started.wait()
+
+        jobs = [threading.Thread(target=job, args=(name,)) for name in 'ab']
+        for thread in jobs:
+            thread.start()
+        for thread in jobs:
+            thread.join(30)
+        assert len(executors) == 10 and len(set(executors)) == 1
+        assert transcoder.executor is None  # Shut down once last call ended
+        assert (transcoder.bytes_in, transcoder.bytes_out) == (1000, 100)
@@ -0,0 +1,62 @@
+# pytest tests/test_uploadscheduler.py
+
+from datetime import datetime
+import pytest
+
+from google_photos_sync_tool.photo import Photo
+from google_photos_sync_tool.uploadscheduler import BandwidthSchedule, UploadScheduler, album_priorities, bandwidth_limit, parse_size
+
+
+class TestUploadScheduler(object):
+    sizes = [('500', 500), ('500K', 500 * 1024), ('2M', 2 * 1024 * 1024), ('1.5G', int(1.5 * 1024 ** 3))]
+    @pytest.mark.parametrize("size,expected", sizes)
+    def test_parse_size(self, size, expected):
+        assert parse_size(size) == expected
+
+    rates = [
+        ('2019-04-09 12:00:00', 500 * 1024),
+        ('2019-04-09 18:00:00', 2 * 1024 * 1024),
+        ('2019-04-09 23:30:00', None),
+        ('2019-04-09 01:00:00', None),
+        ('2019-04-09 06:59:00', None),
+        ('2019-04-09 07:00:00', 2 * 1024 * 1024),
+    ]
+    @pytest.mark.parametrize("dt,expected", rates)
+    def test_bandwidth_schedule(self, dt, expected):
+        schedule = BandwidthSchedule(['08:00-18:00=500K', '22:00-07:00=0', '2M'])
+        rate = schedule.rate_at(datetime.strptime(dt, '%Y-%m-%d %H:%M:%S'))
+        assert (rate or None) == expected
+
+    @pytest.mark.parametrize("limit", ['fast', '08:00-18:00', '08:00-25:00=500K', '08:61-18:00=500K'])
+    def test_invalid_bandwidth_limit(self, limit):
+        with pytest.raises(ValueError):
+            bandwidth_limit(limit)
+
+    def test_invalid_album_priority(self):
+        assert album_priorities({'Blue': {'UploadPriority': '10'}, 'Green': {}}) == {'Blue': 10, 'Green': 0}
+        with pytest.raises(ValueError, match='Blue'):
+            album_priorities({'Blue': {'UploadPriority': 'high'}})
+
+    def test_album_priority_order(self):
+        old_blue = Photo(short_file_path='blue-old.jpg', creationTime='2019-04-09 11:12:51')
+        new_blue = Photo(short_file_path='blue-new.jpg', creationTime='2019-04-10 11:12:51')
+        newest_green = Photo(short_file_path='green.jpg', creationTime='2019-04-11 11:12:51')
+        photos_per_albums = {'Blue': {old_blue, new_blue}, 'Green': {newest_green}}
+        scheduler = UploadScheduler(order='album-priority', album_priorities={'Blue': 10})
+        assert scheduler.sort({old_blue, new_blue, newest_green}, photos_per_albums) == [new_blue, old_blue, newest_green]
+        # Another batch job, whose albums mapping has its own priorities
+        assert scheduler.sort({old_blue, new_blue, newest_green}, photos_per_albums, {'Green': 1}) == [newest_green, new_blue, old_blue]
+
+    def test_byte_budget_is_reserved(self):
+        scheduler = UploadScheduler(max_bytes=1000)
+        assert scheduler.fits(600)
+        assert not scheduler.fits(600)  # Not recorded as sent yet, but already reserved
+        assert scheduler.fits(400)
+
+    def test_time_budget_is_shared_by_uploads(self):
+        scheduler = UploadScheduler(max_duration=60)
+        scheduler.start()
+        assert not scheduler.out_of_time()
+        scheduler.t_start -= 60  # First upload started a minute ago
+        scheduler.start()
+        assert scheduler.out_of_time()